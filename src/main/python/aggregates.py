@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import antibiogram
+import data_cache
+from compaction import SIR_CATEGORIES
+
+
+AGGREGATES_BASENAME = 'aggregates'
+COUNT_COLUMNS = ['batch', 'period', 'organism', 'drug', 'result', 'count']
+KEY_COLUMNS = ['period', 'organism', 'drug', 'result']
+
+
+def count_by_period(df, organism_column, drug_columns, date_column, freq='M'):
+    """Count S/I/R results per period, organism and drug as a long table.
+
+    Drug columns missing from df are skipped.
+    """
+    drug_columns = [col for col in drug_columns if col in df.columns]
+    periods = pd.to_datetime(df[date_column]).dt.to_period(freq)
+    period_codes, period_values = pd.factorize(periods, sort=True)
+    organism_codes, organisms = antibiogram.encode_organisms(df[organism_column])
+    norganisms = len(organisms)
+    ngroups = len(period_values) * norganisms
+    group_codes = np.where((period_codes >= 0) & (organism_codes >= 0),
+                           period_codes.astype(np.int64) * norganisms + organism_codes,
+                           -1)
+    period_labels = np.asarray(period_values.astype(str), dtype=object)
+    organism_labels = np.asarray(organisms, dtype=object)
+    result_labels = np.asarray(SIR_CATEGORIES, dtype=object)
+
+    frames = []
+    for drug in drug_columns:
+        counts = antibiogram.count_results(group_codes, ngroups,
+                                           antibiogram.encode_results(df[drug]))
+        groups, results = np.nonzero(counts)
+        frames.append(pd.DataFrame({
+            'period': period_labels[groups // norganisms],
+            'organism': organism_labels[groups % norganisms],
+            'drug': drug,
+            'result': result_labels[results],
+            'count': counts[groups, results],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=KEY_COLUMNS + ['count'])
+    return pd.concat(frames, ignore_index=True)
+
+
+class AggregateStore(object):
+    """Count aggregates of every imported batch kept in the project directory.
+
+    Adding a batch only counts the new rows, the cumulative totals are then
+    summed from the stored counts instead of the raw data of every batch.
+    """
+    def __init__(self, project_dir):
+        self.basepath = os.path.join(project_dir, AGGREGATES_BASENAME)
+        self.counts = self._load()
+
+    def _load(self):
+        for format, ext in (('feather', '.feather'), ('pickle', '.pkl')):
+            if os.path.exists(self.basepath + ext):
+                return data_cache.read_frame(self.basepath, format)
+        return pd.DataFrame(columns=COUNT_COLUMNS)
+
+    def save(self):
+        data_cache.write_frame(self.basepath, self.counts)
+
+    @property
+    def batches(self):
+        return list(self.counts['batch'].unique())
+
+    def has_batch(self, batch):
+        return batch in set(self.counts['batch'])
+
+    def add_batch(self, batch, df, organism_column, drug_columns, date_column, replace=False):
+        if self.has_batch(batch):
+            if not replace:
+                return False
+            self.remove_batch(batch)
+        counts = count_by_period(df, organism_column, drug_columns, date_column)
+        counts.insert(0, 'batch', batch)
+        self.counts = pd.concat([self.counts, counts], ignore_index=True)
+        return True
+
+    def remove_batch(self, batch):
+        self.counts = self.counts[self.counts['batch'] != batch].reset_index(drop=True)
+
+    def totals(self, periods=None, batches=None):
+        counts = self.counts
+        if periods is not None:
+            counts = counts[counts['period'].isin(periods)]
+        if batches is not None:
+            counts = counts[counts['batch'].isin(batches)]
+        totals = counts.groupby(KEY_COLUMNS, sort=True)['count'].sum()
+        return totals.astype(np.int64).reset_index()
+
+    def antibiogram(self, periods=None):
+        return antibiogram.summarize_counts(self.totals(periods))
+
+    def matches(self, df, organism_column, drug_columns, date_column, batches=None):
+        """Check the stored totals of batches (all by default) against a full recount of df."""
+        expected = count_by_period(df, organism_column, drug_columns, date_column)
+        expected = expected.groupby(KEY_COLUMNS, sort=True)['count'].sum()
+        actual = self.totals(batches=batches).set_index(KEY_COLUMNS)['count']
+        return actual.astype(np.int64).equals(expected.astype(np.int64))
@@ -0,0 +1,142 @@
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from compaction import SIR_CATEGORIES, SIR_DTYPE, normalize_sir
+
+
+RESULT_COLUMNS = ['organism', 'drug', 'N', 'S', 'I', 'R', '%S', '%I', '%R']
+
+
+def encode_results(series):
+    """Return S/I/R results as int8 codes 0, 1, 2 with -1 for anything else."""
+    if not (isinstance(series.dtype, pd.CategoricalDtype)
+            and list(series.cat.categories) == SIR_CATEGORIES):
+        series = normalize_sir(series).astype(SIR_DTYPE)
+    return series.cat.codes.to_numpy()
+
+
+def encode_organisms(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.cat.remove_unused_categories()
+        return series.cat.codes.to_numpy(), series.cat.categories
+    codes, organisms = pd.factorize(series, sort=True)
+    return codes, organisms
+
+
+def count_results(group_codes, ngroups, result_codes):
+    """Count S, I and R per group (e.g. organism) for one drug as an (ngroups, 3) array."""
+    tested = (group_codes >= 0) & (result_codes >= 0)
+    flat = group_codes[tested].astype(np.int64) * 3 + result_codes[tested]
+    return np.bincount(flat, minlength=ngroups * 3).reshape(ngroups, 3)
+
+
+def count_table(df, organism_column, drug_columns):
+    """Return S/I/R counts as an (organisms, drugs, 3) array."""
+    organism_codes, organisms = encode_organisms(df[organism_column])
+    counts = np.zeros((len(organisms), len(drug_columns), 3), dtype=np.int64)
+    for i, drug in enumerate(drug_columns):
+        counts[:, i, :] = count_results(organism_codes, len(organisms),
+                                        encode_results(df[drug]))
+    return counts, organisms
+
+
+def _result_frame(organism_labels, drug_labels, flat):
+    tested = flat.sum(axis=1)
+    keep = tested > 0
+    result = pd.DataFrame({
+        'organism': np.asarray(organism_labels, dtype=object)[keep],
+        'drug': np.asarray(drug_labels, dtype=object)[keep],
+        'N': tested[keep],
+    })
+    for i, result_name in enumerate(SIR_CATEGORIES):
+        result[result_name] = flat[keep, i]
+    for result_name in SIR_CATEGORIES:
+        result['%' + result_name] = (result[result_name] * 100.0 / result['N']).round(1)
+    return result[RESULT_COLUMNS]
+
+
+def summarize(counts, organisms, drug_columns):
+    """Turn an (organisms, drugs, 3) count array into the antibiogram table."""
+    norganisms, ndrugs = counts.shape[:2]
+    return _result_frame(np.repeat(np.asarray(organisms, dtype=object), ndrugs),
+                         np.tile(np.asarray(drug_columns, dtype=object), norganisms),
+                         counts.reshape(norganisms * ndrugs, 3))
+
+
+def summarize_counts(counts):
+    """Summarize a long table of organism, drug, result and count rows."""
+    if counts.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    table = counts.groupby(['organism', 'drug', 'result'])['count'].sum()
+    table = table.unstack('result', fill_value=0).reindex(columns=SIR_CATEGORIES, fill_value=0)
+    return _result_frame(table.index.get_level_values('organism'),
+                         table.index.get_level_values('drug'),
+                         table.to_numpy())
+
+
+def compute(df, organism_column, drug_columns):
+    """Compute %S/%I/%R and the number of tested isolates per organism and drug."""
+    drug_columns = list(drug_columns)
+    if df.empty or not drug_columns:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    counts, organisms = count_table(df, organism_column, drug_columns)
+    return summarize(counts, organisms, drug_columns)
+
+
+def compute_from_config(df, config_data):
+    drug_columns = [col for col in config_data.get('drug_columns', []) if col in df.columns]
+    return compute(df, config_data['organism_column'], drug_columns)
+
+
+def _strata_names(strata):
+    return [s if isinstance(s, str) else s.name for s in strata]
+
+
+def compute_stratified(df, organism_column, drug_columns, strata,
+                       processes=None, progress=None, cancelled=None):
+    """Compute one antibiogram per stratum on a process pool.
+
+    strata is a list of column names or Series aligned with df, for example
+    df[date_column].dt.year. progress(done, total) is called as each stratum
+    finishes and the remaining strata are dropped once cancelled() is True.
+    """
+    drug_columns = list(drug_columns)
+    names = _strata_names(strata)
+    columns = [organism_column] + drug_columns
+    groups = df.groupby(list(strata), sort=True, observed=True).indices
+    tasks = [(key if isinstance(key, tuple) else (key,), indices)
+             for key, indices in groups.items()]
+    results = {}
+
+    def collect(key, result):
+        for name, value in zip(names, key):
+            result[name] = value
+        results[key] = result[names + RESULT_COLUMNS]
+        if progress:
+            progress(len(results), len(tasks))
+
+    if processes == 1 or len(tasks) <= 1:
+        for key, indices in tasks:
+            if cancelled and cancelled():
+                break
+            collect(key, compute(df.iloc[indices][columns], organism_column, drug_columns))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            # only the columns needed are sent to the workers
+            futures = {
+                pool.submit(compute, df.iloc[indices][columns], organism_column, drug_columns): key
+                for key, indices in tasks
+            }
+            for future in concurrent.futures.as_completed(futures):
+                if cancelled and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                collect(futures[future], future.result())
+
+    frames = [results[key] for key, _ in tasks if key in results]
+    if not frames:
+        return pd.DataFrame(columns=names + RESULT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
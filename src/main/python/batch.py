@@ -0,0 +1,202 @@
+"""Run an import and the antibiogram of a project without the user interface.
+
+Usage:
+    python batch.py PROJECT_DIR [--source FILE] [--sheet SHEET] [--output DIR]
+
+The source can be an Excel workbook or a CSV or TSV file.
+
+The column roles, aliases and custom columns saved in the config.yml of the
+project are applied as in the program. This module must not import PyQt5 so
+it can run on machines without a display.
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+import antibiogram
+import compaction
+import config_store
+import data_cache
+import deduplication
+import importers
+import organism_registry
+import trends
+from derived_columns import DerivedColumns
+
+
+WINDOWS = {'all': False, '30days': 30, 'year': 365, 'first': None}
+FORMATS = ['csv', 'xlsx']
+ORGANISMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'organisms.yaml')
+
+
+class Timer(object):
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.timings = []
+
+    def step(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.timings.append((name, elapsed))
+        if self.verbose:
+            sys.stderr.write('{:<24}{:9.3f} s\n'.format(name, elapsed))
+        return result
+
+
+def read_source(project_dir, filename, sheet, config_data, use_cache=True):
+    dtypes, date_columns = importers.dtypes_from_config(config_data)
+    options = importers.cache_options(filename, dtypes, date_columns)
+    df = data_cache.load(project_dir, filename, sheet, options) if use_cache else None
+    if df is None:
+        if importers.is_delimited(filename):
+            df = importers.read_delimited(filename, dtypes, date_columns)
+        else:
+            df = importers.read_sheet(filename, sheet)
+        report = compaction.compact_dataframe(df)
+        if use_cache:
+            try:
+                data_cache.save(project_dir, filename, sheet, df, report, options)
+            except OSError:
+                pass
+    importers.close_workbooks()
+    return df
+
+
+def analysis_columns(config_data):
+    columns = (config_data.get('key_columns', []) + config_data.get('date_columns', [])
+               + config_data.get('drug_columns', []) + [config_data.get('organism_column')])
+    return [col for col in columns if col]
+
+
+def annotate_organisms(df, organism_column, organisms_file):
+    annotations, unmatched = organism_registry.enrich(df[organism_column],
+                                                      organism_registry.load(organisms_file))
+    loc = df.columns.get_loc(organism_column) + 1
+    for offset, name in enumerate(annotations.columns):
+        df.insert(loc + offset, name, annotations[name])
+    return list(annotations.columns), unmatched
+
+
+def export_data(df, config_data, extra_columns=()):
+    """Return the kept columns of df renamed to their aliases."""
+    keep_columns = list(config_data.get('keep_columns', df.columns)) + list(extra_columns)
+    keep_columns = [col for col in df.columns if col in keep_columns]
+    aliases = config_data.get('aliases', {})
+    return df[keep_columns].rename(columns=lambda col: aliases.get(col) or col)
+
+
+def write_table(df, filepath, format, index=False):
+    if format == 'xlsx':
+        df.to_excel(filepath + '.xlsx', index=index)
+    else:
+        df.to_csv(filepath + '.csv', index=index)
+
+
+def run(project_dir, filename=None, sheet=None, output_dir=None, window=False, strata=(),
+        by_year=False, format='csv', with_data=False, use_cache=True, processes=None,
+        annotate=False, organisms_file=ORGANISMS_FILE, trend_freqs=(), verbose=True):
+    timer = Timer(verbose)
+    config_data = config_store.ConfigStore.load(os.path.join(project_dir, 'config.yml'))
+    source = config_data.get('source') or {}
+    filename = filename or source.get('filename')
+    if not filename:
+        raise ValueError('No source file given and none saved in the project.')
+    if sheet is None:
+        sheet = source.get('sheet') if filename == source.get('filename') else None
+    if sheet is None and not importers.is_delimited(filename):
+        sheet = importers.sheet_names(filename)[0]
+    if not config_data.get('organism_column') or not config_data.get('drug_columns'):
+        raise ValueError('The project has no organism column or drug columns.')
+    if trend_freqs and not config_data.get('date_columns'):
+        raise ValueError('The project has no date column for the trends.')
+
+    df = timer.step('read', read_source, project_dir, filename, sheet, config_data, use_cache)
+    derived = DerivedColumns(config_data.get('custom_columns', {}))
+    needed = [col for col in analysis_columns(config_data) + list(strata) if col in derived]
+    if with_data:
+        needed += [col for col in config_data.get('keep_columns', []) if col in derived]
+    timer.step('custom columns', derived.materialize, df, needed)
+    if window is not False:
+        df = timer.step('deduplicate', deduplication.deduplicate_from_config,
+                        df, config_data, window)
+
+    output_dir = output_dir or os.path.join(project_dir, 'output')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    annotation_columns = []
+    if annotate:
+        annotation_columns, unmatched = timer.step('annotate organisms', annotate_organisms, df,
+                                                   config_data['organism_column'], organisms_file)
+        write_table(unmatched.rename_axis('code').reset_index(),
+                    os.path.join(output_dir, 'unmatched_organisms'), format)
+    result = timer.step('antibiogram', antibiogram.compute_from_config, df, config_data)
+    write_table(result, os.path.join(output_dir, 'antibiogram'), format)
+
+    strata = list(strata)
+    if by_year:
+        date_column = config_data['date_columns'][0]
+        # text dates of CSV and xlrd imports are parsed, unreadable ones have no year
+        years = pd.to_datetime(df[date_column], errors='coerce').dt.year
+        strata.insert(0, years.rename('Year of {}'.format(date_column)))
+    if strata:
+        drug_columns = [col for col in config_data['drug_columns'] if col in df.columns]
+        stratified = timer.step('stratified antibiogram', antibiogram.compute_stratified,
+                                df, config_data['organism_column'], drug_columns, strata,
+                                processes=processes)
+        write_table(stratified, os.path.join(output_dir, 'stratified_antibiogram'), format)
+    if trend_freqs:
+        counts = timer.step('trend counts', trends.TrendCounts.from_config, df, config_data)
+        if counts.undated and verbose:
+            sys.stderr.write('{} rows without a valid date are not in the trends\n'.format(counts.undated))
+        for freq in trend_freqs:
+            # every period is summed from the monthly counts
+            write_table(timer.step('trend by {}'.format(freq), counts.table, freq),
+                        os.path.join(output_dir, 'trend_{}'.format(freq)), format)
+    if with_data:
+        timer.step('export data', write_table, export_data(df, config_data, annotation_columns),
+                   os.path.join(output_dir, 'data'), format)
+    return timer.timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the analysis of a Mivisor2 project.')
+    parser.add_argument('project_dir')
+    parser.add_argument('--source', help='Excel, CSV or TSV file, defaults to the last file imported')
+    parser.add_argument('--sheet', help='worksheet, defaults to the last or the first sheet')
+    parser.add_argument('--output', help='output directory, defaults to PROJECT_DIR/output')
+    parser.add_argument('--deduplicate', choices=list(WINDOWS), default='all',
+                        help='keep only the first isolate per patient and organism')
+    parser.add_argument('--strata', nargs='*', default=[],
+                        help='columns to split the antibiogram by')
+    parser.add_argument('--by-year', action='store_true',
+                        help='split the antibiogram by the year of the first date column')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--export-data', action='store_true',
+                        help='also write the kept columns renamed to their aliases')
+    parser.add_argument('--annotate-organisms', action='store_true',
+                        help='add genus, species, gram and group from the organism registry')
+    parser.add_argument('--organisms', default=ORGANISMS_FILE, help='organism registry file')
+    parser.add_argument('--trend', nargs='+', choices=trends.FREQUENCIES, default=[],
+                        help='also write the results of every month, quarter or year')
+    parser.add_argument('--no-cache', action='store_true', help='always read the source file')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--quiet', action='store_true', help='do not print timings')
+    args = parser.parse_args(argv)
+    try:
+        run(args.project_dir, args.source, args.sheet, args.output,
+            window=WINDOWS[args.deduplicate], strata=args.strata, by_year=args.by_year,
+            format=args.format, with_data=args.export_data, use_cache=not args.no_cache,
+            processes=args.processes, annotate=args.annotate_organisms,
+            organisms_file=args.organisms, trend_freqs=args.trend, verbose=not args.quiet)
+    except Exception as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+import pandas as pd
+from pandas.api.types import is_string_dtype
+
+
+def describe(series):
+    if (series.dtype == 'object' or isinstance(series.dtype, pd.CategoricalDtype)
+            or is_string_dtype(series.dtype)):
+        return series.value_counts()
+    else:
+        return series.describe()
+
+
+def profile(series):
+    return str(describe(series))
+
+
+def iter_profiles(df, columns=None):
+    for column in (df.columns if columns is None else columns):
+        if column in df.columns:
+            yield column, profile(df[column])
@@ -0,0 +1,105 @@
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (is_bool_dtype, is_datetime64_any_dtype,
+                              is_float_dtype, is_integer_dtype)
+
+from compaction import SIR_CATEGORIES
+
+
+SAMPLE_SIZE = 1000
+MATCH_THRESHOLD = 0.9
+ORGANISM_THRESHOLD = 0.5
+KEY_UNIQUE_RATIO = 0.9
+
+MIC_PATTERN = re.compile(r'^\s*(?:<=|>=|<|>|=)?\s*\d+(?:\.\d+)?\s*$')
+MIC_OPERATOR_PATTERN = re.compile(r'^\s*(?:<=|>=|<|>)')
+ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9\-/._]*$')
+DATE_PATTERN = re.compile(r'\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}')
+
+
+def sample_rows(df, size=SAMPLE_SIZE):
+    if len(df) <= size:
+        return df
+    # evenly spaced rows cover the whole export, e.g. every month of a year
+    return df.iloc[np.linspace(0, len(df) - 1, size).astype(np.int64)]
+
+
+def _share(mask, weights):
+    return float(weights[np.asarray(mask, dtype=bool)].sum()) / weights.sum() if len(weights) else 0.0
+
+
+def score_column(series, organism_codes=()):
+    """Return the share of the non-missing values that look like each role."""
+    values = series.dropna()
+    scores = {'sir': 0.0, 'mic': 0.0, 'mic_operator': 0.0,
+              'date': 0.0, 'organism': 0.0, 'unique': 0.0, 'id': 0.0}
+    if values.empty:
+        return scores
+    if is_datetime64_any_dtype(values.dtype):
+        scores['date'] = 1.0
+        return scores
+    if is_bool_dtype(values.dtype):
+        return scores
+
+    counts = values.value_counts(sort=False)
+    counts = counts[counts > 0]
+    scores['unique'] = len(counts) / float(len(values))
+    if is_integer_dtype(values.dtype) or is_float_dtype(values.dtype):
+        numbers = counts.index.to_series()
+        scores['id'] = _share(numbers == np.floor(numbers), counts.to_numpy())
+        scores['mic'] = 1.0
+        return scores
+
+    # every check runs once per distinct value and is weighted by its count
+    weights = counts.to_numpy()
+    texts = pd.Series(counts.index.astype(str), dtype=object).str.strip()
+    upper = texts.str.upper()
+    scores['sir'] = _share(upper.isin(SIR_CATEGORIES), weights)
+    scores['mic'] = _share(texts.str.match(MIC_PATTERN), weights)
+    scores['mic_operator'] = _share(texts.str.match(MIC_OPERATOR_PATTERN), weights)
+    scores['organism'] = _share(upper.isin(list(organism_codes)), weights)
+    scores['id'] = _share(texts.str.match(ID_PATTERN), weights)
+    if _share(texts.str.contains(DATE_PATTERN), weights) >= MATCH_THRESHOLD:
+        with warnings.catch_warnings():
+            # pandas warns when it guesses the date format from the first value;
+            # a guess of month first fails on days above 12, so day first is tried too
+            warnings.simplefilter('ignore')
+            scores['date'] = max(
+                _share(pd.to_datetime(texts, errors='coerce', dayfirst=dayfirst).notna(), weights)
+                for dayfirst in (False, True))
+    return scores
+
+
+def looks_like_dates(series, sample_size=SAMPLE_SIZE):
+    """Return whether a sample of series holds dates, as datetimes or as text."""
+    return score_column(sample_rows(series, sample_size))['date'] >= MATCH_THRESHOLD
+
+
+def detect_roles(df, organism_codes=(), drugs=None, sample_size=SAMPLE_SIZE):
+    """Guess key, date, drug and organism columns from a sample of rows.
+
+    drugs is an optional drug_registry.DrugRegistry; column names matching a
+    drug abbreviation only need MIC-like values to count as drug columns.
+    """
+    sample = sample_rows(df, sample_size)
+    organism_codes = set(code.upper() for code in organism_codes)
+    roles = {'key_columns': [], 'date_columns': [], 'drug_columns': [], 'organism_column': ''}
+    best_organism = 0.0
+    for col in df.columns:
+        scores = score_column(sample[col], organism_codes)
+        named_drug = drugs is not None and drugs.match_column(col) is not None
+        if scores['date'] >= MATCH_THRESHOLD:
+            roles['date_columns'].append(col)
+        elif (scores['sir'] >= MATCH_THRESHOLD
+              or (scores['mic'] >= MATCH_THRESHOLD
+                  and (named_drug or scores['mic_operator'] > 0))):
+            roles['drug_columns'].append(col)
+        elif scores['organism'] >= ORGANISM_THRESHOLD and scores['organism'] > best_organism:
+            best_organism = scores['organism']
+            roles['organism_column'] = col
+        elif scores['unique'] >= KEY_UNIQUE_RATIO and scores['id'] >= MATCH_THRESHOLD:
+            roles['key_columns'].append(col)
+    return roles
@@ -0,0 +1,85 @@
+import pandas as pd
+from pandas.api.types import (is_bool_dtype, is_datetime64_any_dtype,
+                              is_float_dtype, is_integer_dtype, is_string_dtype)
+
+
+# S/I/R results are stored as a categorical with fixed categories so that the
+# values are held as int8 codes 0, 1 and 2 (-1 for missing)
+SIR_CATEGORIES = ['S', 'I', 'R']
+SIR_DTYPE = pd.CategoricalDtype(categories=SIR_CATEGORIES)
+
+MAX_CATEGORY_RATIO = 0.5
+
+REPORT_COLUMNS = ['column', 'old_dtype', 'new_dtype', 'before', 'after']
+
+
+def is_categorical(series):
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def is_text(series):
+    return (not is_categorical(series)
+            and not is_bool_dtype(series.dtype)
+            and (series.dtype == object or is_string_dtype(series.dtype)))
+
+
+def normalize_sir(series):
+    return series.astype(str).str.strip().str.upper().where(series.notna())
+
+
+def is_sir_column(series):
+    if is_categorical(series):
+        values = pd.Series(series.cat.categories)
+    elif is_text(series):
+        values = pd.Series(series.dropna().unique())
+    else:
+        return False
+    if values.empty:
+        return False
+    return bool(normalize_sir(values).isin(SIR_CATEGORIES).all())
+
+
+def to_sir(series):
+    return normalize_sir(series).astype(SIR_DTYPE)
+
+
+def compact_series(series):
+    if is_datetime64_any_dtype(series.dtype) or is_bool_dtype(series.dtype):
+        return series
+    if is_sir_column(series):
+        return to_sir(series)
+    if is_integer_dtype(series.dtype):
+        return pd.to_numeric(series, downcast='integer')
+    if is_float_dtype(series.dtype):
+        downcasted = series.astype('float32')
+        # only keep float32 when nothing is lost, e.g. hospital numbers read as floats
+        if ((downcasted.astype(series.dtype) == series) | series.isna()).all():
+            return downcasted
+        return series
+    if is_text(series):
+        nonnull = series.count()
+        if nonnull and series.nunique() <= nonnull * MAX_CATEGORY_RATIO:
+            return series.astype('category')
+    return series
+
+
+def compact_dataframe(df):
+    """Shrink the imported data in place and return a per-column memory report."""
+    report = []
+    for column in df.columns:
+        series = df[column]
+        before = series.memory_usage(index=False, deep=True)
+        compacted = compact_series(series)
+        if compacted is not series:
+            df[column] = compacted
+        after = df[column].memory_usage(index=False, deep=True)
+        report.append((column, str(series.dtype), str(df[column].dtype), before, after))
+    return pd.DataFrame(report, columns=REPORT_COLUMNS)
+
+
+def format_bytes(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024.0 or unit == 'GB':
+            break
+        nbytes /= 1024.0
+    return '{:.1f} {}'.format(nbytes, unit)
@@ -0,0 +1,169 @@
+import copy
+import os
+import tempfile
+import threading
+
+from collections.abc import MutableMapping
+
+import yaml
+
+
+# libyaml is much faster on the large alias and description maps of wide sheets
+Loader = getattr(yaml, 'CLoader', yaml.Loader)
+Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+SAVE_DELAY = 0.5
+
+
+def write_atomic(filepath, data):
+    """Dump data to a temporary file next to filepath and rename it over filepath.
+
+    A crash while writing leaves the old file in place instead of a truncated one.
+    """
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_filepath = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=dirname)
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            yaml.dump(data, stream=temp_file, Dumper=Dumper)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if os.path.exists(filepath):
+            # mkstemp creates the file readable by its owner only
+            os.chmod(temp_filepath, os.stat(filepath).st_mode)
+        os.replace(temp_filepath, filepath)
+    except Exception:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        raise
+
+
+class ConfigStore(MutableMapping):
+    """The config.yml of a project, saved in the background after changes settle.
+
+    Values are read and assigned like a dict. Assigned keys are marked dirty;
+    lists or dicts changed in place have to be assigned again or passed to
+    mark_dirty. schedule_save takes a snapshot of the data and writes it on a
+    timer thread once no other save was requested for SAVE_DELAY seconds.
+    Snapshots are numbered and a snapshot older than the last one written is
+    never written over it. Changes are only written by save or schedule_save.
+    """
+    def __init__(self, filepath, data=None):
+        self.filepath = filepath
+        self._data = dict(data or {})
+        self._dirty = set()
+        self._callbacks = []
+        self._timer = None
+        self._pending = None
+        self._sequence = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, 'r') as config_file:
+            return cls(filepath, yaml.load(config_file, Loader=Loader))
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._dirty.add(key)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._dirty.add(key)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def mark_dirty(self, key):
+        self._dirty.add(key)
+
+    @property
+    def dirty(self):
+        """The keys changed since the last save or scheduled save."""
+        return frozenset(self._dirty)
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def _snapshot(self):
+        # called with self._lock held
+        dirty, self._dirty = self._dirty, set()
+        self._sequence += 1
+        return self._sequence, self.to_dict(), dirty
+
+    def save(self):
+        """Write the config now, in the calling thread."""
+        with self._lock:
+            self._cancel_timer()
+            self._pending = None
+            callbacks, self._callbacks = self._callbacks, []
+            snapshot = self._snapshot()
+        return self._write(snapshot, callbacks)
+
+    def schedule_save(self, callback=None, delay=SAVE_DELAY):
+        """Save in the background after delay seconds without another request.
+
+        callback is called from the writing thread with None or the exception
+        raised while writing.
+        """
+        with self._lock:
+            self._cancel_timer()
+            if callback is not None:
+                self._callbacks.append(callback)
+            # snapshot on the calling thread, the data is not touched by the writer
+            self._pending = self._snapshot()
+            self._timer = threading.Timer(delay, self._timer_save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write a scheduled save now and wait for a write in progress.
+
+        Changes that were never saved or scheduled are not written.
+        """
+        if not self._write_pending():
+            with self._write_lock:
+                pass
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _write_pending(self):
+        with self._lock:
+            self._cancel_timer()
+            snapshot, self._pending = self._pending, None
+            callbacks, self._callbacks = self._callbacks, []
+        if snapshot is None:
+            return False
+        self._write(snapshot, callbacks)
+        return True
+
+    def _timer_save(self):
+        self._write_pending()
+
+    def _write(self, snapshot, callbacks):
+        sequence, data, dirty = snapshot
+        error = None
+        with self._write_lock:
+            # a newer snapshot may have been written while this one waited
+            if sequence > self._written:
+                try:
+                    write_atomic(self.filepath, data)
+                except Exception as e:
+                    # the keys are saved again with the next save
+                    self._dirty.update(dirty)
+                    error = e
+                else:
+                    self._written = sequence
+        for callback in callbacks:
+            callback(error)
+        return error
@@ -0,0 +1,103 @@
+import hashlib
+import os
+
+import pandas as pd
+import yaml
+
+import compaction
+
+
+CACHE_DIRNAME = 'cache'
+
+
+def write_frame(basepath, df):
+    df = df.reset_index(drop=True)
+    try:
+        df.to_feather(basepath + '.feather')
+        return 'feather'
+    except (ImportError, ValueError, TypeError):
+        # pyarrow is missing or the columns hold mixed types
+        df.to_pickle(basepath + '.pkl')
+        return 'pickle'
+
+
+def read_frame(basepath, format):
+    if format == 'feather':
+        return pd.read_feather(basepath + '.feather')
+    return pd.read_pickle(basepath + '.pkl')
+
+
+def source_info(filename, sheet):
+    stat = os.stat(filename)
+    return {
+        'filename': os.path.abspath(filename),
+        'sheet': sheet,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+
+
+def _cache_basepath(project_dir, filename, sheet):
+    digest = hashlib.sha1(
+        u'{}|{}'.format(os.path.abspath(filename), sheet).encode('utf-8')
+    ).hexdigest()[:16]
+    return os.path.join(project_dir, CACHE_DIRNAME, digest)
+
+
+def _read_meta(basepath):
+    meta_filepath = basepath + '.yml'
+    if not os.path.exists(meta_filepath):
+        return None
+    with open(meta_filepath, 'r') as meta_file:
+        return yaml.load(meta_file, Loader=yaml.SafeLoader)
+
+
+def is_valid(project_dir, filename, sheet, options=None):
+    """Return whether the cached sheet was read from the same file with the same options."""
+    if not project_dir or not os.path.exists(filename):
+        return False
+    meta = _read_meta(_cache_basepath(project_dir, filename, sheet))
+    if not meta:
+        return False
+    info = source_info(filename, sheet)
+    return (all(meta.get(k) == info[k] for k in ('filename', 'sheet', 'size', 'mtime'))
+            and meta.get('options') == options)
+
+
+def load_report(project_dir, filename, sheet, options=None):
+    if not is_valid(project_dir, filename, sheet, options):
+        return None
+    meta = _read_meta(_cache_basepath(project_dir, filename, sheet))
+    report = meta.get('compaction')
+    if report:
+        return pd.DataFrame(report, columns=compaction.REPORT_COLUMNS)
+
+
+def load(project_dir, filename, sheet, options=None):
+    """Return the cached sheet or None when the source file or the read options have changed."""
+    if not is_valid(project_dir, filename, sheet, options):
+        return None
+    basepath = _cache_basepath(project_dir, filename, sheet)
+    meta = _read_meta(basepath)
+    try:
+        return read_frame(basepath, meta.get('format'))
+    except Exception:
+        return None
+
+
+def save(project_dir, filename, sheet, df, report=None, options=None):
+    if not project_dir:
+        return
+    basepath = _cache_basepath(project_dir, filename, sheet)
+    os.makedirs(os.path.dirname(basepath), exist_ok=True)
+    meta = source_info(filename, sheet)
+    if options is not None:
+        meta['options'] = options
+    if report is not None:
+        meta['compaction'] = [
+            {k: (v.item() if hasattr(v, 'item') else v) for k, v in record.items()}
+            for record in report.to_dict('records')
+        ]
+    meta['format'] = write_frame(basepath, df)
+    with open(basepath + '.yml', 'w') as meta_file:
+        yaml.dump(meta, stream=meta_file, Dumper=yaml.SafeDumper)
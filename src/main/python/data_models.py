@@ -1,43 +1,295 @@
+from collections import OrderedDict
+
 import PyQt5.QtWidgets as qtw
 import PyQt5.QtCore as qtc
 import PyQt5.QtGui as qtg
+import numpy as np
 import pandas as pd
 
+import column_profiles
+import row_filters
+import row_sorting
+
 
 class PandasModel(qtc.QAbstractTableModel):
-    def __init__(self, dataframe, head_row=0):
+    # rows are handed to the view in blocks so that only what is scrolled
+    # into view is ever converted to text
+    FETCH_SIZE = 1000
+    MAX_CACHED_BLOCKS = 200
+
+    def __init__(self, dataframe, head_row=0, derived=None):
         super(PandasModel, self).__init__()
         if head_row == 0:
             self.data = dataframe
         else:
             self.data = dataframe.head(head_row)
+        # derived (custom) columns are listed next to their source columns
+        # but only built when they are first displayed or used
+        self.derived = derived
+        self._column_names = self._layout_columns()
+        # positions of the rows shown, None shows every row of the data in order;
+        # filtering and sorting only change these, never the data
+        self._rows = None
+        self._filtered_rows = None
+        self._sorted_rows = None
+        self.sort_keys = []
+        self.filter_clauses = []
+        self.row_filter = row_filters.RowFilter(self.column, lambda: self._column_names)
+        self.row_sorter = row_sorting.RowSorter(self.column)
+        self._fetched_rows = min(self.FETCH_SIZE, len(self.data))
+        self._column_arrays = {}
+        self._text_blocks = OrderedDict()
+        # column profiles are filled in by a background worker after import
+        self._profiles = {}
+
+    def rowCount(self, parent=qtc.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._fetched_rows
+
+    def columnCount(self, parent=qtc.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._column_names)
 
-    def rowCount(self, parent):
-        return len(self.data)
+    def canFetchMore(self, parent):
+        if parent.isValid():
+            return False
+        return self._fetched_rows < self.visible_row_count()
 
-    def columnCount(self, parent):
-        return len(self.data.columns)
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        remainder = self.visible_row_count() - self._fetched_rows
+        count = min(self.FETCH_SIZE, remainder)
+        if count <= 0:
+            return
+        self.beginInsertRows(qtc.QModelIndex(),
+                             self._fetched_rows,
+                             self._fetched_rows + count - 1)
+        self._fetched_rows += count
+        self.endInsertRows()
+
+    def _layout_columns(self):
+        names = list(self.data.columns)
+        if self.derived is None:
+            return names
+        for name in self.derived.available(names):
+            names.insert(names.index(self.derived.source(name)) + 1, name)
+        return names
 
     @property
     def columns(self):
-        return self.data.columns
+        return pd.Index(self._column_names)
 
-    def describe(self, column):
-        if self.data[column].dtype == 'object':
-            return self.data[column].value_counts()
+    def is_derived(self, column):
+        return column not in self.data.columns and self.derived is not None and column in self.derived
+
+    def column(self, name):
+        if self.is_derived(name):
+            return self.derived.get(self.data, name)
+        return self.data[name]
+
+    def column_array(self, col):
+        # keep one Series per column instead of rebuilding DataFrame.values
+        if col not in self._column_arrays:
+            self._column_arrays[col] = self.column(self._column_names[col])
+        return self._column_arrays[col]
+
+    def _text_block(self, block, col):
+        key = (block, col)
+        if key in self._text_blocks:
+            self._text_blocks.move_to_end(key)
+            return self._text_blocks[key]
+        start = block * self.FETCH_SIZE
+        if self._rows is None:
+            values = self.column_array(col).iloc[start:start + self.FETCH_SIZE]
+        else:
+            values = self.column_array(col).iloc[self._rows[start:start + self.FETCH_SIZE]]
+        # convert data to string or date will not display
+        texts = values.astype(str).tolist()
+        self._text_blocks[key] = texts
+        if len(self._text_blocks) > self.MAX_CACHED_BLOCKS:
+            self._text_blocks.popitem(last=False)
+        return texts
+
+    def clear_cache(self):
+        self._column_arrays.clear()
+        self._text_blocks.clear()
+        self.row_filter.clear()
+        self.row_sorter.clear()
+
+    def visible_row_count(self):
+        return len(self.data) if self._rows is None else len(self._rows)
+
+    def row_positions(self):
+        """Return the positions in the data of the rows shown."""
+        if self._rows is None:
+            return np.arange(len(self.data))
+        return self._rows
+
+    def set_filter(self, text):
+        """Show only the rows matching the clauses of text, see row_filters.parse.
+
+        Raises row_filters.FilterError before changing the rows shown.
+        """
+        clauses = row_filters.parse(text)
+        self._filtered_rows = self.row_filter.rows(clauses)
+        self.filter_clauses = clauses
+        self._update_rows()
+
+    def sort(self, column, order=qtc.Qt.AscendingOrder):
+        self.sort_by([(self._column_names[column], order == qtc.Qt.AscendingOrder)])
+
+    def sort_by(self, keys):
+        """Show the rows sorted by keys, a list of (column, ascending); [] restores the order."""
+        self._sorted_rows = self.row_sorter.order(keys)
+        self.sort_keys = list(keys)
+        self._update_rows()
+
+    def _reapply_rows(self):
+        """Sort and filter again after the values of columns have changed.
+
+        A filter that cannot be used on the new values is cleared.
+        """
+        self.sort_keys = [key for key in self.sort_keys if key[0] in self._column_names]
+        self._sorted_rows = self.row_sorter.order(self.sort_keys)
+        try:
+            self._filtered_rows = self.row_filter.rows(self.filter_clauses)
+        except row_filters.FilterError:
+            self.filter_clauses = []
+            self._filtered_rows = None
+
+    def _update_rows(self):
+        self.beginResetModel()
+        self._set_rows()
+        self.endResetModel()
+
+    def _set_rows(self):
+        rows = self._sorted_rows
+        if self._filtered_rows is not None:
+            if rows is None:
+                rows = self._filtered_rows
+            else:
+                keep = np.zeros(len(self.data), dtype=bool)
+                keep[self._filtered_rows] = True
+                rows = rows[keep[rows]]
+        self._rows = rows
+        self._fetched_rows = min(self.FETCH_SIZE, self.visible_row_count())
+        self._text_blocks.clear()
+
+    def add_derived_column(self, colname, spec):
+        if not colname or colname in self.data.columns or colname == spec['colname']:
+            raise ValueError('{} cannot be used as the name of a new column.'.format(colname))
+        self.derived.set_spec(colname, spec)
+        self.invalidate_profile(colname)
+        if colname in self._column_names:
+            self.clear_cache()
+            # the rows shown may be sorted or filtered on the old values
+            self._reapply_rows()
+            self._update_rows()
+            return
+        loc = self._column_names.index(spec['colname']) + 1
+        self.beginInsertColumns(qtc.QModelIndex(), loc, loc)
+        self._column_names.insert(loc, colname)
+        self.clear_cache()
+        self.endInsertColumns()
+
+    def insert_columns(self, column, frame):
+        """Add the columns of frame to the data right after column, replacing older ones."""
+        self.beginResetModel()
+        for name in frame.columns:
+            if name in self.data.columns:
+                del self.data[name]
+        if self.derived is not None:
+            self.derived.invalidate(frame.columns)
+        if column in self.data.columns:
+            loc = self.data.columns.get_loc(column) + 1
         else:
-            return self.data[column].describe()
+            loc = len(self.data.columns)
+        for offset, name in enumerate(frame.columns):
+            self.data.insert(loc + offset, name, frame[name])
+            self.invalidate_profile(name)
+        self._column_names = self._layout_columns()
+        self.clear_cache()
+        self._reapply_rows()
+        self._set_rows()
+        self.endResetModel()
+
+    def frame(self, columns=()):
+        """Return the data with the given derived columns added."""
+        derived = [col for col in columns if col and self.is_derived(col)]
+        if not derived:
+            return self.data
+        return self.data.assign(**{col: self.column(col) for col in derived})
 
-    def data(self, index, role):
+    def set_profile(self, column, text):
+        self._profiles[column] = text
+
+    def invalidate_profile(self, column):
+        self._profiles.pop(column, None)
+
+    def describe(self, column):
+        if column not in self._profiles:
+            self._profiles[column] = column_profiles.profile(self.column(column))
+        return self._profiles[column]
+
+    def data(self, index, role=qtc.Qt.DisplayRole):
+        if not index.isValid():
+            return None
         if role == qtc.Qt.DisplayRole:
-            # convert data to string or date will not display
-            return str(self.data.values[index.row(), index.column()])
+            block, offset = divmod(index.row(), self.FETCH_SIZE)
+            return self._text_block(block, index.column())[offset]
 
     def headerData(self, section, orientation, role=None):
         if(
             orientation == qtc.Qt.Horizontal and role == qtc.Qt.DisplayRole
         ):
-            return self.data.columns[section]
+            return self._column_names[section]
         else:
             return super(PandasModel, self).headerData(section, orientation, role)
 
+
+class OrganismTableModel(qtc.QAbstractTableModel):
+    """Shows an organism_registry.OrganismRegistry, optionally filtered by text."""
+    HEADERS = ['Code', 'Group', 'Gram', 'Genus', 'Species', 'Subspecies', 'Property', 'Note']
+
+    def __init__(self, registry):
+        super(OrganismTableModel, self).__init__()
+        self.registry = registry
+        self._filter_text = ''
+        self._rows = registry.search('')
+
+    def rowCount(self, parent=qtc.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=qtc.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def data(self, index, role=qtc.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == qtc.Qt.DisplayRole:
+            return self.registry.frame.iat[self._rows[index.row()], index.column()]
+
+    def headerData(self, section, orientation, role=None):
+        if orientation == qtc.Qt.Horizontal and role == qtc.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return super(OrganismTableModel, self).headerData(section, orientation, role)
+
+    def code(self, row):
+        return self.registry.frame.index[self._rows[row]]
+
+    def set_filter(self, text):
+        self._filter_text = text
+        self.refresh()
+
+    def refresh(self):
+        """Reload the rows after the registry or the filter changed."""
+        self.beginResetModel()
+        self._rows = self.registry.search(self._filter_text)
+        self.endResetModel()
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+
+# window lengths offered for the first isolate rule, None keeps only the
+# very first isolate of each patient and organism
+WINDOWS = {
+    'First isolate per 30 days': 30,
+    'First isolate per year': 365,
+    'First isolate only': None,
+}
+
+
+def _to_timedelta(window):
+    if window is None:
+        return None
+    if isinstance(window, (int, float)):
+        return pd.Timedelta(days=window)
+    return pd.Timedelta(window)
+
+
+def _codes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy().astype(np.int64)
+    return pd.factorize(series)[0].astype(np.int64)
+
+
+def first_isolates(df, key_columns, organism_column, date_column, window=None):
+    """Mark the first isolate per patient and organism within a time window.
+
+    The rows are sorted once by key, organism and date. The first row of every
+    group is a first isolate; with a window a later row starts a new episode
+    when it is at least the window length after the previous episode start.
+    Each round of the loop adds at most one new episode per group, so the
+    number of rounds is bounded by the number of episodes, not rows.
+    """
+    window = _to_timedelta(window)
+    columns = list(key_columns) + [organism_column]
+    codes = [_codes(df[col]) for col in columns]
+    dates = pd.to_datetime(df[date_column])
+    valid = dates.notna().to_numpy().copy()
+    for col_codes in codes:
+        valid &= col_codes >= 0
+
+    # np.lexsort sorts by the last key first
+    order = np.lexsort([dates.to_numpy()] + codes[::-1])
+    order = order[valid[order]]
+    sorted_codes = [col_codes[order] for col_codes in codes]
+    sorted_dates = dates.to_numpy()[order].astype('datetime64[ns]').astype(np.int64)
+
+    n = len(order)
+    new_group = np.ones(n, dtype=bool)
+    if n > 1:
+        new_group[1:] = False
+        for col_codes in sorted_codes:
+            new_group[1:] |= col_codes[1:] != col_codes[:-1]
+
+    first = new_group.copy()
+    if window is not None and n:
+        window_ns = window.value
+        positions = np.arange(n)
+        while True:
+            # the latest episode start at or before each row
+            anchor = np.maximum.accumulate(np.where(first, positions, 0))
+            due = ~first & (sorted_dates - sorted_dates[anchor] >= window_ns)
+            if not due.any():
+                break
+            # dates are sorted within a group, so only the first due row
+            # after an episode start opens the next episode
+            starts = due.copy()
+            starts[1:] &= ~due[:-1]
+            first |= starts
+
+    mask = np.zeros(len(df), dtype=bool)
+    mask[order[first]] = True
+    return pd.Series(mask, index=df.index, name='first_isolate')
+
+
+def deduplicate(df, key_columns, organism_column, date_column, window=None):
+    return df[first_isolates(df, key_columns, organism_column, date_column, window).to_numpy()]
+
+
+def deduplicate_from_config(df, config_data, window=None):
+    return deduplicate(df,
+                       config_data['key_columns'],
+                       config_data['organism_column'],
+                       config_data['date_columns'][0],
+                       window)
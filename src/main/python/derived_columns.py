@@ -0,0 +1,121 @@
+import hashlib
+import weakref
+
+import pandas as pd
+import yaml
+
+import value_grouping
+
+
+def fingerprint(series):
+    hashes = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def _spec_key(spec):
+    return yaml.dump(spec, Dumper=yaml.SafeDumper)
+
+
+class DerivedColumns(object):
+    """The custom_columns of config.yml as a graph of columns built on demand.
+
+    Each derived column depends on one source column, which may itself be
+    derived. A column is only built when asked for and the result is kept
+    for the frame it was built from until invalidate is called for its
+    source. For another frame, e.g. after a re-import, the source is hashed
+    once and only columns whose source data changed are built again.
+    """
+    def __init__(self, specs=None):
+        self.specs = {}
+        self._memo = {}
+        self.set_specs(specs or {})
+
+    def set_specs(self, specs):
+        changed = [name for name in specs if self.specs.get(name) != specs[name]]
+        self.specs = dict(specs)
+        for name in list(self._memo):
+            if name not in self.specs:
+                del self._memo[name]
+        self.invalidate(changed)
+
+    def set_spec(self, name, spec):
+        self.specs[name] = spec
+        self.invalidate([name])
+
+    def invalidate(self, columns):
+        """Forget the built columns that depend on any of columns, e.g. after they were replaced."""
+        columns = set(columns)
+        for name in self.order():
+            if name in columns or self.source(name) in columns:
+                columns.add(name)
+                memo = self._memo.get(name)
+                if memo is not None:
+                    # the fingerprint is kept for a re-import of the same data
+                    self._memo[name] = (memo[0], memo[1], None)
+
+    def __contains__(self, name):
+        return name in self.specs
+
+    def source(self, name):
+        return self.specs[name]['colname']
+
+    def order(self, names=None):
+        """Return derived column names so that every column follows its source."""
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in ordered or name not in self.specs:
+                return
+            if name in visiting:
+                raise ValueError('Custom column {} depends on itself.'.format(name))
+            visiting.add(name)
+            visit(self.source(name))
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in (self.specs if names is None else names):
+            visit(name)
+        return ordered
+
+    def available(self, columns):
+        """Return the derived columns that can be built from the given columns."""
+        columns = set(columns)
+        names = []
+        for name in self.order():
+            if name not in columns and self.source(name) in columns:
+                columns.add(name)
+                names.append(name)
+        return names
+
+    def get(self, df, name):
+        spec_key = _spec_key(self.specs[name])
+        memo = self._memo.get(name)
+        if (memo is not None and memo[2] is not None and memo[2]() is df
+                and memo[0][1] == spec_key):
+            return memo[1]
+        source_name = self.source(name)
+        if source_name in df.columns:
+            source = df[source_name]
+        else:
+            source = self.get(df, source_name)
+        key = (fingerprint(source), spec_key)
+        if memo is None or memo[0] != key or not memo[1].index.equals(df.index):
+            column = value_grouping.apply_custom_column(
+                pd.DataFrame({source_name: source}), self.specs[name]
+            ).rename(name)
+        else:
+            column = memo[1]
+        self._memo[name] = (key, column, weakref.ref(df))
+        return column
+
+    def materialize(self, df, names=None):
+        """Add derived columns to df right after their source columns."""
+        for name in self.order(names):
+            if name in df.columns:
+                continue
+            source_name = self.source(name)
+            if source_name not in df.columns:
+                continue
+            df.insert(df.columns.get_loc(source_name) + 1, name, self.get(df, name))
+        return df
@@ -0,0 +1,169 @@
+import os
+
+import yaml
+
+
+class Drug(object):
+    def __init__(self, name, abbrs, group):
+        self.name = name
+        self.abbrs = abbrs
+        self.group = group
+
+    def __repr__(self):
+        return 'Drug({!r}, {!r}, {!r})'.format(self.name, self.abbrs, self.group)
+
+    def to_entry(self):
+        # drugs.yaml keeps each drug as "name;abbr1,abbr2"
+        return u'{};{}'.format(self.name, ','.join(self.abbrs))
+
+
+def parse_abbrs(text):
+    return [abbr.strip() for abbr in text.split(',') if abbr.strip()]
+
+
+def _key(text):
+    return text.strip().lower()
+
+
+class DrugRegistry(object):
+    """Drug groups parsed once from drugs.yaml with lookups by name and abbreviation."""
+    def __init__(self, data=None):
+        self.groups = {}
+        self._drugs = {}
+        self._abbrs = {}
+        for group, entries in (data or {}).items():
+            self.add_group(group)
+            for entry in entries or []:
+                name, _, abbrs = entry.partition(';')
+                self.add_drug(group, name, parse_abbrs(abbrs))
+
+    @classmethod
+    def from_file(cls, filepath):
+        with open(filepath, 'r') as drug_file:
+            return cls(yaml.load(drug_file, Loader=yaml.Loader))
+
+    def copy(self):
+        return DrugRegistry(self.to_data())
+
+    def to_data(self):
+        return {group: [drug.to_entry() for drug in drugs]
+                for group, drugs in self.groups.items()}
+
+    def save(self, filepath):
+        with open(filepath, 'w') as drug_file:
+            yaml.dump(self.to_data(), stream=drug_file, Dumper=yaml.Dumper)
+        _registries[os.path.abspath(filepath)] = (os.stat(filepath).st_mtime, self.copy())
+
+    def has_group(self, group):
+        return group in self.groups
+
+    def __iter__(self):
+        for drugs in self.groups.values():
+            for drug in drugs:
+                yield drug
+
+    def get(self, name):
+        return self._drugs.get(_key(name))
+
+    def lookup(self, abbr):
+        """Find a drug by one of its abbreviations or its name, ignoring case."""
+        key = _key(abbr)
+        return self._abbrs.get(key) or self._drugs.get(key)
+
+    def match_column(self, colname):
+        drug = self.lookup(str(colname))
+        if drug is None and '_' in str(colname):
+            # WHONET style result columns such as AMP_ND10 or AMP_NM
+            drug = self.lookup(str(colname).split('_', 1)[0])
+        return drug
+
+    def _index(self, drug):
+        self._drugs[_key(drug.name)] = drug
+        for abbr in drug.abbrs:
+            self._abbrs[_key(abbr)] = drug
+
+    def _unindex(self, drug):
+        # another drug may share the name or an abbreviation, keep its keys
+        names = set(key for key in [_key(drug.name)] if self._drugs.get(key) is drug)
+        abbrs = set(_key(abbr) for abbr in drug.abbrs if self._abbrs.get(_key(abbr)) is drug)
+        for key in names:
+            del self._drugs[key]
+        for key in abbrs:
+            del self._abbrs[key]
+        if not names and not abbrs:
+            return
+        # and give the freed keys back to the remaining drugs that have them
+        for other in self:
+            if other is drug:
+                continue
+            if _key(other.name) in names:
+                self._drugs[_key(other.name)] = other
+            for abbr in other.abbrs:
+                if _key(abbr) in abbrs:
+                    self._abbrs[_key(abbr)] = other
+
+    def has_drug(self, drug):
+        return drug in self.groups.get(drug.group, {})
+
+    def add_group(self, group):
+        self.groups.setdefault(group, {})
+
+    def rename_group(self, group, new_group):
+        if group == new_group:
+            return
+        if not new_group or new_group in self.groups:
+            raise ValueError('{} cannot be used as the name of a drug group.'.format(new_group))
+        # rebuild the mapping so the group keeps its position
+        self.groups = {
+            (new_group if name == group else name): drugs
+            for name, drugs in self.groups.items()
+        }
+        for drug in self.groups[new_group]:
+            drug.group = new_group
+
+    def remove_group(self, group):
+        for drug in self.groups.pop(group, {}):
+            self._unindex(drug)
+
+    def add_drug(self, group, name, abbrs):
+        self.add_group(group)
+        drug = Drug(name.strip(), list(abbrs), group)
+        # each group is an insertion ordered set of drugs
+        self.groups[group][drug] = None
+        self._index(drug)
+        return drug
+
+    def edit_drug(self, drug, new_name, abbrs):
+        """Rename drug and replace its abbreviations, None if it is not in the registry.
+
+        Drugs are passed as objects, the same name may be in several groups.
+        """
+        if not self.has_drug(drug):
+            return None
+        self._unindex(drug)
+        drug.name = new_name.strip()
+        drug.abbrs = list(abbrs)
+        self._index(drug)
+        return drug
+
+    def remove_drug(self, drug):
+        if not self.has_drug(drug):
+            return None
+        del self.groups[drug.group][drug]
+        self._unindex(drug)
+        return drug
+
+
+# registries keyed by file path and cached until the file is modified
+_registries = {}
+
+
+def load(filepath='drugs.yaml'):
+    """Return the registry of filepath, parsed again only when its mtime changes."""
+    filepath = os.path.abspath(filepath)
+    mtime = os.stat(filepath).st_mtime
+    cached = _registries.get(filepath)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, DrugRegistry.from_file(filepath))
+        _registries[filepath] = cached
+    return cached[1]
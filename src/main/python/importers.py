@@ -0,0 +1,455 @@
+import codecs
+import concurrent.futures
+import csv
+import os
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import compaction
+import data_cache
+
+# the Excel readers are imported with the first workbook opened, importing
+# them at startup slows down the program for nothing
+xlrd = None
+openpyxl = None
+_readers_imported = False
+
+
+CHUNK_SIZE = 5000
+MAX_OPEN_WORKBOOKS = 2
+
+SPREADSHEETML_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# opened workbooks keyed by (path, size, mtime) so the file picked in the
+# worksheet dialog is not parsed again when the sheet is read
+_workbooks = OrderedDict()
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+def is_xlsx(filename):
+    return os.path.splitext(filename)[1].lower() in ('.xlsx', '.xlsm')
+
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime
+
+
+def _import_readers():
+    global xlrd, openpyxl, _readers_imported
+    if _readers_imported:
+        return
+    import xlrd as xlrd_module
+    xlrd = xlrd_module
+    try:
+        import openpyxl as openpyxl_module
+    except ImportError:
+        pass
+    else:
+        openpyxl = openpyxl_module
+    _readers_imported = True
+
+
+def _uses_openpyxl(filename):
+    _import_readers()
+    return is_xlsx(filename) and openpyxl is not None
+
+
+def _close_workbook(workbook):
+    if isinstance(workbook, xlrd.book.Book):
+        workbook.release_resources()
+    else:
+        workbook.close()
+
+
+def open_workbook(filename):
+    key = _file_key(filename)
+    if key in _workbooks:
+        _workbooks.move_to_end(key)
+        return _workbooks[key]
+    for cached_key in [k for k in _workbooks if k[0] == key[0]]:
+        _close_workbook(_workbooks.pop(cached_key))
+
+    if _uses_openpyxl(filename):
+        workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    else:
+        # on_demand only parses the workbook globals, sheets are loaded when asked for
+        workbook = xlrd.open_workbook(filename, on_demand=True)
+    _workbooks[key] = workbook
+    while len(_workbooks) > MAX_OPEN_WORKBOOKS:
+        _close_workbook(_workbooks.popitem(last=False)[1])
+    return workbook
+
+
+def close_workbooks():
+    while _workbooks:
+        _close_workbook(_workbooks.popitem()[1])
+
+
+def _xlsx_sheet_names(filename):
+    with zipfile.ZipFile(filename) as archive:
+        with archive.open('xl/workbook.xml') as workbook_xml:
+            tree = ElementTree.parse(workbook_xml)
+    return [sheet.get('name') for sheet in tree.iter(SPREADSHEETML_NS + 'sheet')]
+
+
+def sheet_names(filename):
+    if is_xlsx(filename):
+        try:
+            return _xlsx_sheet_names(filename)
+        except (KeyError, zipfile.BadZipFile):
+            pass
+    workbook = open_workbook(filename)
+    if isinstance(workbook, xlrd.book.Book):
+        return workbook.sheet_names()
+    return list(workbook.sheetnames)
+
+
+def _xlrd_cell_value(cell, datemode):
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate.xldate_as_datetime(cell.value, datemode)
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    if cell.ctype == xlrd.XL_CELL_ERROR:
+        return None
+    if cell.ctype == xlrd.XL_CELL_NUMBER:
+        # .xls stores every number as a float; like pandas, whole numbers are
+        # read as integers so 1234 does not turn into 1234.0
+        value = cell.value
+        return int(value) if value == int(value) else value
+    return cell.value
+
+
+def iter_sheet_rows(filename, sheet):
+    """Yield the total row count (0 if unknown) followed by each row as a tuple."""
+    workbook = open_workbook(filename)
+    if isinstance(workbook, xlrd.book.Book):
+        worksheet = workbook.sheet_by_name(sheet)
+        try:
+            yield worksheet.nrows
+            for i in range(worksheet.nrows):
+                yield tuple(_xlrd_cell_value(cell, workbook.datemode)
+                            for cell in worksheet.row(i))
+        finally:
+            workbook.unload_sheet(sheet)
+    else:
+        worksheet = workbook[sheet]
+        yield worksheet.max_row or 0
+        for row in worksheet.iter_rows(values_only=True):
+            yield row
+
+
+def make_column_names(header):
+    names = []
+    seen = {}
+    for i, name in enumerate(header):
+        if name is None or str(name).strip() == '':
+            name = 'Unnamed: {}'.format(i)
+        name = str(name)
+        # mangle duplicated names the same way pandas.read_excel does
+        if name in seen:
+            seen[name] += 1
+            name = '{}.{}'.format(name, seen[name])
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _append_chunk(column_chunks, rows):
+    ncols = len(column_chunks)
+    for i in range(ncols):
+        values = [row[i] if i < len(row) else None for row in rows]
+        column_chunks[i].append(pd.Series(values).infer_objects())
+
+
+def read_sheet(filename, sheet, chunk_size=CHUNK_SIZE, progress=None, cancelled=None):
+    """Read a worksheet in chunks of rows.
+
+    Every chunk is converted to typed columns right away so the raw rows never
+    pile up. progress(rows_read, total_rows) is called after each chunk and
+    ImportCancelled is raised as soon as cancelled() returns True.
+    """
+    rows = iter_sheet_rows(filename, sheet)
+    total_rows = next(rows)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+    columns = make_column_names(header)
+    if total_rows:
+        total_rows -= 1
+
+    column_chunks = [[] for _ in columns]
+    buffer = []
+    nrows = 0
+    for row in rows:
+        if all(value is None for value in row):
+            continue
+        buffer.append(row)
+        if len(buffer) == chunk_size:
+            if cancelled and cancelled():
+                rows.close()
+                raise ImportCancelled()
+            _append_chunk(column_chunks, buffer)
+            nrows += len(buffer)
+            buffer = []
+            if progress:
+                progress(nrows, max(total_rows, nrows))
+    if buffer:
+        _append_chunk(column_chunks, buffer)
+        nrows += len(buffer)
+    if progress:
+        progress(nrows, nrows)
+
+    data = {}
+    for name, chunks in zip(columns, column_chunks):
+        if chunks:
+            data[name] = pd.concat(chunks, ignore_index=True).infer_objects()
+        else:
+            data[name] = pd.Series([], dtype='object')
+        # free the chunks of this column before joining the next one
+        del chunks[:]
+    return pd.DataFrame(data, columns=columns)
+
+
+DELIMITED_EXTENSIONS = {'.csv': ',', '.tsv': '\t', '.tab': '\t', '.txt': None}
+CSV_CHUNK_SIZE = 100000
+# utf-8-sig also reads utf-8 without a byte order mark; exports from Thai
+# Windows machines are often cp874, and latin-1 can decode any bytes
+ENCODINGS = ['utf-8-sig', 'cp874', 'latin-1']
+
+
+def is_delimited(filename):
+    return os.path.splitext(filename)[1].lower() in DELIMITED_EXTENSIONS
+
+
+def detect_encoding(filename, sample_size=64 * 1024):
+    """Return the first of ENCODINGS that decodes the start of filename."""
+    with open(filename, 'rb') as raw_file:
+        sample = raw_file.read(sample_size)
+    for encoding in ENCODINGS[:-1]:
+        try:
+            # not final, the sample may end inside a character
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    return ENCODINGS[-1]
+
+
+def _sniff_separator(filename, encoding):
+    with open(filename, 'r', encoding=encoding, newline='') as text_file:
+        sample = text_file.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',\t;|').delimiter
+    except csv.Error:
+        return ','
+
+
+def dtypes_from_config(config_data):
+    """Return read_delimited dtypes and date columns for the column roles of a project.
+
+    Keys stay text so leading zeros are kept; organism and drug columns are
+    read straight into categoricals.
+    """
+    dtypes = {col: 'str' for col in config_data.get('key_columns', [])}
+    for col in config_data.get('drug_columns', []) + [config_data.get('organism_column')]:
+        if col:
+            dtypes[col] = 'category'
+    return dtypes, list(config_data.get('date_columns', []))
+
+
+def cache_options(filename, dtypes=None, date_columns=()):
+    """Return the read options the cached frame of filename depends on.
+
+    Only CSV and TSV files are read with dtypes and date columns.
+    """
+    if not is_delimited(filename):
+        return None
+    return {'dtypes': dict(dtypes or {}), 'date_columns': list(date_columns)}
+
+
+def _join_chunks(chunks):
+    if not chunks:
+        return pd.Series([], dtype='object')
+    if all(isinstance(chunk.dtype, pd.CategoricalDtype) for chunk in chunks):
+        # chunks have their own categories, concat would fall back to objects
+        return pd.Series(union_categoricals(chunks, ignore_order=True))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_delimited(filename, dtypes=None, date_columns=(), sep=None, encoding=None,
+                   chunk_size=CSV_CHUNK_SIZE, progress=None, cancelled=None):
+    """Read a CSV or TSV file in chunks of rows with the C parser.
+
+    dtypes and date_columns only apply to columns found in the header.
+    progress(rows_read, estimated_rows) is called after each chunk, the total
+    is estimated from the share of the file read so far. Without an encoding
+    it is detected from the start of the file, and the file is read again
+    with the next of ENCODINGS when a later row cannot be decoded.
+    """
+    if encoding is not None:
+        return _read_delimited(filename, dtypes, date_columns, sep, encoding,
+                               chunk_size, progress, cancelled)
+    encodings = ENCODINGS[ENCODINGS.index(detect_encoding(filename)):]
+    for encoding in encodings[:-1]:
+        try:
+            return _read_delimited(filename, dtypes, date_columns, sep, encoding,
+                                   chunk_size, progress, cancelled)
+        except UnicodeDecodeError:
+            pass
+    return _read_delimited(filename, dtypes, date_columns, sep, encodings[-1],
+                           chunk_size, progress, cancelled)
+
+
+def _read_delimited(filename, dtypes, date_columns, sep, encoding, chunk_size, progress, cancelled):
+    if sep is None:
+        sep = DELIMITED_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if sep is None:
+        sep = _sniff_separator(filename, encoding)
+    header = pd.read_csv(filename, sep=sep, encoding=encoding, nrows=0).columns
+    dtypes = {col: dtype for col, dtype in (dtypes or {}).items() if col in header}
+    date_columns = [col for col in date_columns if col in header and col not in dtypes]
+    total_bytes = os.path.getsize(filename)
+
+    column_chunks = {col: [] for col in header}
+    nrows = 0
+    with open(filename, 'rb') as raw_file:
+        reader = pd.read_csv(raw_file, sep=sep, encoding=encoding, engine='c', dtype=dtypes,
+                             parse_dates=date_columns, chunksize=chunk_size)
+        for chunk in reader:
+            if cancelled and cancelled():
+                reader.close()
+                raise ImportCancelled()
+            for col in header:
+                column_chunks[col].append(chunk[col].reset_index(drop=True))
+            nrows += len(chunk)
+            if progress:
+                read_bytes = max(raw_file.tell(), 1)
+                progress(nrows, max(nrows, int(nrows * total_bytes / read_bytes)))
+    if progress:
+        progress(nrows, nrows)
+    data = {}
+    for col in header:
+        data[col] = _join_chunks(column_chunks[col])
+        del column_chunks[col][:]
+    return pd.DataFrame(data, columns=header)
+
+
+EXCEL_EXTENSIONS = ('.xls', '.xlsx', '.xlsm')
+
+
+def excel_files(folder):
+    # ~$ files are the lock files Excel leaves next to open workbooks
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if os.path.splitext(name)[1].lower() in EXCEL_EXTENSIONS
+                  and not name.startswith('~$'))
+
+
+def _normalize_name(name):
+    return ' '.join(str(name).split()).lower()
+
+
+def align_columns(df, aliases):
+    """Rename columns to the project's column names.
+
+    A column matches a project column or its alias in the aliases map of
+    config.yml, ignoring case and repeated spaces.
+    """
+    names = {}
+    for column, alias in aliases.items():
+        if alias:
+            names[_normalize_name(alias)] = column
+    for column in aliases:
+        names[_normalize_name(column)] = column
+    renamed = {}
+    used = set(df.columns)
+    for col in df.columns:
+        name = names.get(_normalize_name(col), col)
+        if name != col and name not in used:
+            renamed[col] = name
+            used.add(name)
+    return df.rename(columns=renamed)
+
+
+def read_workbook(filename, sheets=None, aliases=None, project_dir=None):
+    """Read the sheets of a workbook as (sheet, compacted frame) pairs with aligned columns.
+
+    Sheets are read from and saved to the cache of project_dir like a
+    single imported sheet. A sheet named in sheets but missing from the
+    workbook raises ValueError.
+    """
+    frames = []
+    try:
+        names = sheet_names(filename)
+        for sheet in sheets or names:
+            if sheet not in names:
+                raise ValueError('The workbook has no sheet {}.'.format(sheet))
+            df = data_cache.load(project_dir, filename, sheet)
+            if df is None:
+                df = read_sheet(filename, sheet)
+                report = compaction.compact_dataframe(df)
+                try:
+                    data_cache.save(project_dir, filename, sheet, df, report)
+                except OSError:
+                    pass
+            if df.empty:
+                continue
+            frames.append((sheet, align_columns(df, aliases or {})))
+    finally:
+        close_workbooks()
+    return frames
+
+
+def read_files(filenames, aliases=None, sheets=None, project_dir=None, processes=None,
+               progress=None, cancelled=None):
+    """Read many workbooks on a process pool and join their sheets into one table.
+
+    sheets lists the sheets read from every workbook, all sheets by default.
+    Columns missing from some files are filled with missing values. Returns
+    the table, a {filename: error message} dict of the files that failed and
+    the (filename, sheet, rows) of every part of the table in order.
+    progress(done, total, filename) is called as each file finishes and the
+    remaining files are dropped once cancelled() is True.
+    """
+    results = {}
+    errors = {}
+
+    def collect(filename, read):
+        try:
+            results[filename] = read()
+        except Exception as e:
+            errors[filename] = str(e)
+        if progress:
+            progress(len(results) + len(errors), len(filenames), filename)
+
+    if processes == 1 or len(filenames) <= 1:
+        for filename in filenames:
+            if cancelled and cancelled():
+                raise ImportCancelled()
+            collect(filename, lambda: read_workbook(filename, sheets, aliases, project_dir))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(read_workbook, filename, sheets, aliases, project_dir): filename
+                       for filename in filenames}
+            for future in concurrent.futures.as_completed(futures):
+                if cancelled and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    raise ImportCancelled()
+                collect(futures[future], future.result)
+
+    parts = [(filename, sheet, df) for filename in filenames for sheet, df in results.get(filename, [])]
+    if not parts:
+        return pd.DataFrame(), errors, []
+    df = pd.concat([frame for _, _, frame in parts], ignore_index=True, sort=False)
+    return df, errors, [(filename, sheet, len(frame)) for filename, sheet, frame in parts]
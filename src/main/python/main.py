@@ -1,26 +1,44 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import os
-from collections import defaultdict
+import multiprocessing
 
 from fbs_runtime.application_context.PyQt5 import ApplicationContext
 import PyQt5.QtWidgets as qtw
 import PyQt5.QtCore as qtc
 import PyQt5.QtGui as qtg
-from project_dialogs import MainProjectWindow, NewProjectDialog
 
 import sys
-import yaml
-
-import pandas as pd
 
 VERSION_NUMBER = '2.0rc'
 
-appctxt = ApplicationContext()  # 1. Instantiate ApplicationContext
-main_project_window = MainProjectWindow()
+startup_steps = []
+reported_steps = 0
+
+
+def mark_startup(step):
+    startup_steps.append((step, time.perf_counter() - STARTUP_TIME))
+
+
+def report_startup():
+    """Print the startup steps timed since the last report."""
+    global reported_steps
+    if not os.environ.get('MIVISOR2_STARTUP_TIMING') and '--startup-timing' not in sys.argv:
+        return
+    for step, elapsed in startup_steps[reported_steps:]:
+        sys.stderr.write('{:<28}{:8.3f} s\n'.format(step, elapsed))
+    reported_steps = len(startup_steps)
+
+
+mark_startup('Qt imported')
+
 
 class MainWindow(qtw.QMainWindow):
     settings = qtc.QSettings('MUMT', 'Mivisor2')
     def __init__(self):
         super(MainWindow, self).__init__()
+        self.project_window = None
 
         self.setWindowTitle('Mivisor2')
         menubar = self.menuBar()
@@ -109,6 +127,9 @@ class MainWindow(qtw.QMainWindow):
         about_dialog.show()
 
     def showNewProjectDialog(self):
+        # project_dialogs pulls in pandas and the Excel readers, it is only imported
+        # when a project is created or opened so the welcome window shows up sooner
+        from project_dialogs import NewProjectDialog
         form = NewProjectDialog(self)
         form.setModal(True)
         form.create_project_signal.connect(self.openProject)
@@ -133,16 +154,43 @@ class MainWindow(qtw.QMainWindow):
                 qtc.QDir.homePath(),
             )
 
+        if not project_dir:
+            return
+
         #TODO: insert the current project to the recent project list
-        main_project_window.show()
-        main_project_window.close_signal.connect(self.show)
+        self.settings.setValue('current_proj_dir', project_dir)
+        if self.project_window is None:
+            # the window reads the config of the current project when it is built
+            self.project_window = self.createProjectWindow()
+        else:
+            self.project_window.load_config()
+        self.project_window.load_source_data()
+        self.project_window.show()
         self.close()
 
+    def createProjectWindow(self):
+        start = time.perf_counter()
+        # imported here for the same reason as in showNewProjectDialog
+        from project_dialogs import MainProjectWindow
+        project_window = MainProjectWindow()
+        project_window.close_signal.connect(self.show)
+        startup_steps.append(('project window (build time)', time.perf_counter() - start))
+        report_startup()
+        return project_window
+
 
 
 if __name__ == '__main__':
+    # process pool workers import this module again, they must not reach the
+    # application context; a frozen app also needs this before anything else
+    multiprocessing.freeze_support()
+    appctxt = ApplicationContext()  # 1. Instantiate ApplicationContext
+    mark_startup('application context')
     window = MainWindow()
     window.resize(600, 450)
     window.show()
+    mark_startup('welcome window created')
+    # runs once the event loop has painted the window
+    qtc.QTimer.singleShot(0, lambda: (mark_startup('welcome window shown'), report_startup()))
     exit_code = appctxt.app.exec_()      # 2. Invoke appctxt.app.exec_()
     sys.exit(exit_code)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import config_store
+
+
+FIELDS = ['code', 'group', 'gram', 'genus', 'species', 'subspecies', 'property', 'note']
+# fields searched by the type-ahead filter of the registry dialog
+SEARCH_FIELDS = ['code', 'genus', 'species', 'group']
+# fields added to the isolates by enrich
+ENRICH_FIELDS = ['genus', 'species', 'gram', 'group']
+
+
+def _clean(df):
+    """Return df with the registry fields as stripped text columns."""
+    df = df.rename(columns=lambda col: str(col).strip().lower())
+    df = df.reindex(columns=FIELDS)
+    return df.fillna('').astype(str).apply(lambda col: col.str.strip())
+
+
+class OrganismRegistry(object):
+    """Organisms of organisms.yaml held as one text column per field, indexed by code."""
+    def __init__(self, frame=None):
+        if frame is None:
+            frame = pd.DataFrame(columns=FIELDS)
+        self.frame = _clean(frame).set_index('code', drop=False).rename_axis(None)
+        self._search = None
+        self._lookup = None
+
+    @classmethod
+    def from_data(cls, data):
+        if not data:
+            return cls()
+        frame = pd.DataFrame.from_dict(data, orient='index')
+        # the key of each entry is the code of the organism
+        frame['code'] = frame.index.astype(str)
+        return cls(frame)
+
+    @classmethod
+    def from_file(cls, filepath):
+        with open(filepath, 'r') as org_file:
+            return cls.from_data(yaml.load(org_file, Loader=config_store.Loader))
+
+    def copy(self):
+        return OrganismRegistry(self.frame.reset_index(drop=True))
+
+    def to_data(self):
+        return self.frame.to_dict(orient='index')
+
+    def save(self, filepath):
+        config_store.write_atomic(filepath, self.to_data())
+        _registries[os.path.abspath(filepath)] = (os.stat(filepath).st_mtime, self.copy())
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, code):
+        return code in self.frame.index
+
+    def codes(self):
+        return self.frame.index
+
+    def get(self, code):
+        if code not in self.frame.index:
+            return None
+        return self.frame.loc[code].to_dict()
+
+    def value(self, row, field):
+        return self.frame.iat[row, FIELDS.index(field)]
+
+    def position(self, code):
+        return self.frame.index.get_loc(code)
+
+    def _changed(self):
+        self._search = None
+        self._lookup = None
+
+    def lookup(self):
+        """Return the registry codes and each field as a categorical, built once.
+
+        Codes are matched ignoring case and surrounding spaces.
+        """
+        if self._lookup is None:
+            keys = self.frame.index.str.strip().str.upper()
+            first = ~keys.duplicated()
+            # empty fields become missing values instead of an '' category
+            fields = {field: pd.Categorical(self.frame[field].replace('', np.nan).to_numpy()[first])
+                      for field in ENRICH_FIELDS}
+            self._lookup = (pd.Index(keys[first]), fields)
+        return self._lookup
+
+    def set_organism(self, record, old_code=None):
+        """Add an organism or replace the one with old_code (or the same code)."""
+        record = _clean(pd.DataFrame([record])).iloc[0]
+        if old_code is not None and old_code != record['code'] and old_code in self.frame.index:
+            self.frame = self.frame.drop(old_code)
+        self.frame.loc[record['code']] = record
+        self._changed()
+
+    def remove(self, code):
+        if code in self.frame.index:
+            self.frame = self.frame.drop(code)
+            self._changed()
+
+    def prepare_import(self, df):
+        """Split the rows of an imported sheet into new and conflicting organisms.
+
+        Rows need a code and a genus or group; for repeated codes the last row
+        is used. Conflicts are rows whose code is registered with other values.
+        """
+        df = _clean(df)
+        df = df[(df['code'] != '') & ((df['genus'] != '') | (df['group'] != ''))]
+        df = df.drop_duplicates('code', keep='last').set_index('code', drop=False).rename_axis(None)
+        registered = df.index.isin(self.frame.index)
+        existing = self.frame.reindex(df.index[registered])
+        differs = (existing.to_numpy() != df[registered].to_numpy()).any(axis=1)
+        conflicts = df[registered][differs]
+        return df[~registered], conflicts
+
+    def add_organisms(self, df):
+        """Add or replace the organisms of a frame returned by prepare_import."""
+        if df.empty:
+            return
+        self.frame = pd.concat([self.frame.drop(df.index, errors='ignore'), df[FIELDS]])
+        self._changed()
+
+    def search(self, text):
+        """Return the positions of organisms with text in one of SEARCH_FIELDS."""
+        text = text.strip().lower()
+        if not text:
+            return np.arange(len(self.frame))
+        if self._search is None:
+            # one lower-cased key per organism, built once until the next edit
+            keys = self.frame[SEARCH_FIELDS[0]]
+            for field in SEARCH_FIELDS[1:]:
+                keys = keys + '\t' + self.frame[field]
+            self._search = keys.str.lower()
+        return np.flatnonzero(self._search.str.contains(text, regex=False).to_numpy())
+
+
+def _codes_and_uniques(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), pd.Index(series.cat.categories)
+    return pd.factorize(series)
+
+
+def enrich(series, registry, fields=ENRICH_FIELDS):
+    """Annotate a column of organism codes with fields of the registry.
+
+    Each distinct code is looked up once and the matches are spread to the
+    rows through the codes of the column. Returns a frame of categorical
+    columns named '<column>_<field>' aligned with series and the number of
+    rows of every code missing from the registry.
+    """
+    codes, uniques = _codes_and_uniques(series)
+    keys, lookup_fields = registry.lookup()
+    if len(uniques) and len(keys):
+        positions = keys.get_indexer(pd.Index(uniques.astype(str)).str.strip().str.upper())
+    else:
+        # an empty column or registry matches nothing
+        positions = np.full(len(uniques), -1, dtype=np.intp)
+    unique_missing = positions < 0
+    # the code -1 of missing values and unmatched codes take the appended -1
+    row_positions = np.append(positions, -1)[codes]
+    columns = {}
+    for field in fields:
+        categorical = lookup_fields[field]
+        field_codes = np.append(categorical.codes, -1)[row_positions]
+        columns['{}_{}'.format(series.name, field)] = pd.Categorical.from_codes(
+            field_codes, categories=categorical.categories)
+    annotations = pd.DataFrame(columns, index=series.index)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    unmatched = pd.Series(counts[unique_missing], index=uniques[unique_missing], name='count')
+    unmatched = unmatched[unmatched > 0].sort_values(ascending=False)
+    return annotations, unmatched
+
+
+# registries keyed by file path and cached until the file is modified
+_registries = {}
+
+
+def load(filepath='organisms.yaml'):
+    """Return the registry of filepath, parsed again only when its mtime changes."""
+    filepath = os.path.abspath(filepath)
+    mtime = os.stat(filepath).st_mtime
+    cached = _registries.get(filepath)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, OrganismRegistry.from_file(filepath))
+        _registries[filepath] = cached
+    return cached[1]
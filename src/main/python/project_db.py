@@ -0,0 +1,195 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (is_bool_dtype, is_datetime64_any_dtype,
+                              is_float_dtype, is_integer_dtype)
+
+import antibiogram
+from compaction import SIR_CATEGORIES, is_sir_column, normalize_sir
+
+
+DATABASE_FILENAME = 'project.db'
+TABLE = 'isolates'
+# the file and sheet each record was imported from, as in the aggregate store
+BATCH_COLUMN = '_batch'
+INSERT_CHUNK_SIZE = 50000
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def quote(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def _sql_type(series):
+    if is_bool_dtype(series.dtype) or is_integer_dtype(series.dtype):
+        return 'INTEGER'
+    if is_float_dtype(series.dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _sql_values(series):
+    """Return the values of series as Python objects sqlite3 can bind, None if missing."""
+    if is_datetime64_any_dtype(series.dtype):
+        # ISO dates sort and compare correctly as text
+        series = series.dt.strftime(DATE_FORMAT)
+    elif is_sir_column(series):
+        # stored as plain S, I or R so results are counted without string functions
+        series = normalize_sir(series)
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+class ProjectDatabase(object):
+    """Isolate records of a project kept in an SQLite file in the project directory.
+
+    Records are stored per batch so a sheet imported again replaces its rows.
+    Filters and antibiogram counts run in SQL and only their results are read.
+    A connection can only be used by the thread that opened it.
+    """
+    def __init__(self, project_dir):
+        self.filepath = os.path.join(project_dir, DATABASE_FILENAME)
+        self.connection = sqlite3.connect(self.filepath)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+    def close(self):
+        self.connection.close()
+
+    def columns(self):
+        return [row[1] for row in self.connection.execute('PRAGMA table_info({})'.format(quote(TABLE)))
+                if row[1] != BATCH_COLUMN]
+
+    def _ensure_columns(self, df):
+        existing = set(self.columns())
+        if not existing:
+            definitions = ['{} TEXT'.format(quote(BATCH_COLUMN))]
+            definitions += ['{} {}'.format(quote(col), _sql_type(df[col])) for col in df.columns]
+            self.connection.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                quote(TABLE), ', '.join(definitions)))
+            return
+        for col in df.columns:
+            if col not in existing:
+                self.connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    quote(TABLE), quote(col), _sql_type(df[col])))
+
+    def create_index(self, column):
+        self.connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+            quote('idx_{}_{}'.format(TABLE, column)), quote(TABLE), quote(column)))
+
+    def batches(self):
+        if not self.columns():
+            return pd.Series(dtype='int64')
+        rows = self.connection.execute('SELECT {0}, COUNT(*) FROM {1} GROUP BY {0}'.format(
+            quote(BATCH_COLUMN), quote(TABLE))).fetchall()
+        return pd.Series(dict(rows), dtype='int64')
+
+    def has_batch(self, batch):
+        return batch in self.batches().index
+
+    def add_batch(self, batch, df, index_columns=(), progress=None):
+        """Insert the rows of df as batch, replacing the rows of an older import.
+
+        index_columns, e.g. the key, date and organism columns, get an index.
+        progress(rows, total) is called after each chunk of rows.
+        """
+        columns = [str(col) for col in df.columns]
+        df = df.set_axis(columns, axis=1)
+        with self.connection:
+            self._ensure_columns(df)
+            self.connection.execute('DELETE FROM {} WHERE {} = ?'.format(
+                quote(TABLE), quote(BATCH_COLUMN)), (batch,))
+            sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+                quote(TABLE),
+                ', '.join(quote(col) for col in [BATCH_COLUMN] + columns),
+                ', '.join(['?'] * (len(columns) + 1)))
+            for start in range(0, len(df), INSERT_CHUNK_SIZE):
+                chunk = df.iloc[start:start + INSERT_CHUNK_SIZE]
+                values = [_sql_values(chunk[col]) for col in columns]
+                self.connection.executemany(sql, zip([batch] * len(chunk), *values))
+                if progress:
+                    progress(min(start + INSERT_CHUNK_SIZE, len(df)), len(df))
+            # indexes are only created after the first batch has been inserted
+            self.create_index(BATCH_COLUMN)
+            for col in index_columns:
+                if col in columns:
+                    self.create_index(col)
+
+    def remove_batch(self, batch):
+        with self.connection:
+            self.connection.execute('DELETE FROM {} WHERE {} = ?'.format(
+                quote(TABLE), quote(BATCH_COLUMN)), (batch,))
+
+    def _where(self, date_column=None, start=None, end=None, organism_column=None, organisms=None):
+        conditions = []
+        params = []
+        if date_column and start is not None:
+            conditions.append('{} >= ?'.format(quote(date_column)))
+            params.append(pd.Timestamp(start).strftime(DATE_FORMAT))
+        if date_column and end is not None:
+            # the end date is included as a whole day
+            conditions.append('{} < ?'.format(quote(date_column)))
+            params.append((pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).strftime(DATE_FORMAT))
+        if organism_column and organisms:
+            conditions.append('{} IN ({})'.format(quote(organism_column), ', '.join(['?'] * len(organisms))))
+            params.extend(organisms)
+        if not conditions:
+            return '', params
+        return ' WHERE ' + ' AND '.join(conditions), params
+
+    def count(self, **filters):
+        if not self.columns():
+            return 0
+        where, params = self._where(**filters)
+        return self.connection.execute('SELECT COUNT(*) FROM {}{}'.format(quote(TABLE), where),
+                                       params).fetchone()[0]
+
+    def date_range(self, date_column):
+        if date_column not in self.columns():
+            return None, None
+        first, last = self.connection.execute('SELECT MIN({0}), MAX({0}) FROM {1}'.format(
+            quote(date_column), quote(TABLE))).fetchone()
+        return (pd.Timestamp(first) if first else None), (pd.Timestamp(last) if last else None)
+
+    def load(self, columns=None, date_columns=(), limit=None, **filters):
+        """Read the rows matching filters; only the given columns are read."""
+        existing = self.columns()
+        columns = [col for col in (columns or existing) if col in existing]
+        if not columns:
+            return pd.DataFrame()
+        where, params = self._where(**filters)
+        sql = 'SELECT {} FROM {}{}'.format(', '.join(quote(col) for col in columns), quote(TABLE), where)
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return pd.read_sql_query(sql, self.connection, params=params,
+                                 parse_dates=[col for col in date_columns if col in columns])
+
+    def result_counts(self, organism_column, drug_columns, **filters):
+        """Count S/I/R results per organism and drug in one scan of the table.
+
+        Returns an (organisms, drugs, 3) array with the organisms and the drug
+        columns found in the table, as used by antibiogram.summarize.
+        """
+        existing = self.columns()
+        drug_columns = [drug for drug in drug_columns if drug in existing]
+        if organism_column not in existing or not drug_columns:
+            return np.zeros((0, len(drug_columns), 3), dtype=np.int64), [], drug_columns
+        filters['organism_column'] = organism_column
+        where, params = self._where(**filters)
+        counts = ['COUNT(CASE {} WHEN ? THEN 1 END)'.format(quote(drug))
+                  for drug in drug_columns for _ in SIR_CATEGORIES]
+        sql = 'SELECT {org}, {counts} FROM {table}{where} {conj} {org} IS NOT NULL GROUP BY {org}'.format(
+            org=quote(organism_column), counts=', '.join(counts), table=quote(TABLE),
+            where=where, conj='AND' if where else 'WHERE')
+        rows = self.connection.execute(sql, SIR_CATEGORIES * len(drug_columns) + params).fetchall()
+        organisms = [row[0] for row in rows]
+        table = np.array([row[1:] for row in rows], dtype=np.int64).reshape(
+            len(rows), len(drug_columns), len(SIR_CATEGORIES))
+        return table, organisms, drug_columns
+
+    def antibiogram(self, organism_column, drug_columns, **filters):
+        counts, organisms, drug_columns = self.result_counts(organism_column, drug_columns, **filters)
+        if not organisms:
+            return pd.DataFrame(columns=antibiogram.RESULT_COLUMNS)
+        return antibiogram.summarize(counts, organisms, drug_columns)
@@ -1,20 +1,37 @@
 import os
-from collections import defaultdict
+import re
 
-import xlrd
 import pandas as pd
-from pandas.api.types import is_datetime64_any_dtype
 import datetime as dt
-import yaml
 
 import PyQt5.QtWidgets as qtw
 import PyQt5.QtCore as qtc
 import PyQt5.QtGui as qtg
 
-from data_models import PandasModel
+import aggregates
+import antibiogram
+import column_profiles
+import column_roles
+import compaction
+import config_store
+import data_cache
+import deduplication
+import drug_registry
+import importers
+import organism_registry
+import project_db
+import row_filters
+import trends
+import value_grouping
+from data_models import OrganismTableModel, PandasModel
+from derived_columns import DerivedColumns
 from config_template import config
 
 
+# the check column of each role in the column tree
+ROLE_COLUMNS = [(1, 'key_columns'), (2, 'date_columns'), (3, 'drug_columns'), (4, 'organism_column')]
+
+
 class NotificationDialog(qtw.QDialog):
     def __init__(self, parent, title, message, modal=True):
         super(NotificationDialog, self).__init__(parent=parent)
@@ -37,7 +54,7 @@ class XlrdOpenFileThread(qtc.QThread):
 
     def run(self):
         try:
-            worksheets = xlrd.open_workbook(self.filename).sheet_names()
+            worksheets = importers.sheet_names(self.filename)
         except Exception as e:
             self.xlrd_read_workbook_error.emit(e)
         else:
@@ -47,21 +64,182 @@ class XlrdOpenFileThread(qtc.QThread):
 class PandasReadExcelThread(qtc.QThread):
     pandas_read_excel_finished = qtc.pyqtSignal(pd.DataFrame)
     pandas_read_excel_error = qtc.pyqtSignal(Exception)
+    pandas_read_excel_progress = qtc.pyqtSignal(int, int)
+    pandas_read_excel_cancelled = qtc.pyqtSignal()
+    pandas_read_excel_compacted = qtc.pyqtSignal(object)
 
-    def __init__(self, filename, sheet):
+    def __init__(self, filename, sheet, chunked=True, project_dir=None, dtypes=None, date_columns=()):
         super(PandasReadExcelThread, self).__init__()
         self.filename = filename
         self.sheet = sheet
+        self.chunked = chunked
+        self.project_dir = project_dir
+        # only used for CSV and TSV files, Excel cells carry their own types
+        self.dtypes = dtypes
+        self.date_columns = date_columns
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def is_cancelled(self):
+        return self._cancel_requested
 
     def run(self):
         try:
-            df = pd.read_excel(self.filename, self.sheet)
+            options = importers.cache_options(self.filename, self.dtypes, self.date_columns)
+            df = data_cache.load(self.project_dir, self.filename, self.sheet, options)
+            if df is None:
+                if importers.is_delimited(self.filename):
+                    df = importers.read_delimited(self.filename, self.dtypes, self.date_columns,
+                                                  progress=self.pandas_read_excel_progress.emit,
+                                                  cancelled=self.is_cancelled)
+                elif self.chunked:
+                    df = importers.read_sheet(self.filename, self.sheet,
+                                              progress=self.pandas_read_excel_progress.emit,
+                                              cancelled=self.is_cancelled)
+                else:
+                    df = pd.read_excel(self.filename, self.sheet)
+                report = compaction.compact_dataframe(df)
+                try:
+                    data_cache.save(self.project_dir, self.filename, self.sheet, df, report, options)
+                except OSError:
+                    pass
+            else:
+                report = data_cache.load_report(self.project_dir, self.filename, self.sheet, options)
+        except importers.ImportCancelled:
+            self.pandas_read_excel_cancelled.emit()
         except Exception as e:
             self.pandas_read_excel_error.emit(e)
         else:
+            if report is not None:
+                self.pandas_read_excel_compacted.emit(report)
             self.pandas_read_excel_finished.emit(df)
 
 
+class FolderImportThread(qtc.QThread):
+    folder_import_finished = qtc.pyqtSignal(pd.DataFrame)
+    folder_import_error = qtc.pyqtSignal(Exception)
+    folder_import_progress = qtc.pyqtSignal(int, int, str)
+    folder_import_cancelled = qtc.pyqtSignal()
+    folder_import_compacted = qtc.pyqtSignal(object)
+    folder_import_file_errors = qtc.pyqtSignal(object)
+    folder_import_parts = qtc.pyqtSignal(object)
+
+    def __init__(self, filenames, aliases, sheets=None, project_dir=None):
+        super(FolderImportThread, self).__init__()
+        self.filenames = filenames
+        self.aliases = aliases
+        self.sheets = sheets
+        self.project_dir = project_dir
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def is_cancelled(self):
+        return self._cancel_requested
+
+    def run(self):
+        try:
+            df, errors, parts = importers.read_files(self.filenames, self.aliases, self.sheets,
+                                                     self.project_dir,
+                                                     progress=self.folder_import_progress.emit,
+                                                     cancelled=self.is_cancelled)
+            report = compaction.compact_dataframe(df)
+        except importers.ImportCancelled:
+            self.folder_import_cancelled.emit()
+        except Exception as e:
+            self.folder_import_error.emit(e)
+        else:
+            if errors:
+                self.folder_import_file_errors.emit(errors)
+            if df.empty:
+                self.folder_import_error.emit(ValueError('No data was read from the folder.'))
+                return
+            self.folder_import_compacted.emit(report)
+            self.folder_import_parts.emit(parts)
+            self.folder_import_finished.emit(df)
+
+
+class ColumnProfileThread(qtc.QThread):
+    column_profile_ready = qtc.pyqtSignal(str, str)
+
+    def __init__(self, df, columns=None):
+        super(ColumnProfileThread, self).__init__()
+        self.df = df
+        self.columns = columns
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def run(self):
+        for column, text in column_profiles.iter_profiles(self.df, self.columns):
+            if self._cancel_requested:
+                break
+            self.column_profile_ready.emit(column, text)
+
+
+class StratifiedAntibiogramThread(qtc.QThread):
+    stratified_antibiogram_finished = qtc.pyqtSignal(object)
+    stratified_antibiogram_error = qtc.pyqtSignal(Exception)
+    stratified_antibiogram_progress = qtc.pyqtSignal(int, int)
+
+    def __init__(self, df, organism_column, drug_columns, strata):
+        super(StratifiedAntibiogramThread, self).__init__()
+        self.df = df
+        self.organism_column = organism_column
+        self.drug_columns = drug_columns
+        self.strata = strata
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def is_cancelled(self):
+        return self._cancel_requested
+
+    def run(self):
+        try:
+            result = antibiogram.compute_stratified(
+                self.df, self.organism_column, self.drug_columns, self.strata,
+                progress=self.stratified_antibiogram_progress.emit,
+                cancelled=self.is_cancelled
+            )
+        except Exception as e:
+            self.stratified_antibiogram_error.emit(e)
+        else:
+            if not self._cancel_requested:
+                self.stratified_antibiogram_finished.emit(result)
+
+
+class DatabaseImportThread(qtc.QThread):
+    database_import_finished = qtc.pyqtSignal()
+    database_import_error = qtc.pyqtSignal(Exception)
+    database_import_progress = qtc.pyqtSignal(int, int)
+
+    def __init__(self, project_dir, batch, df, index_columns):
+        super(DatabaseImportThread, self).__init__()
+        self.project_dir = project_dir
+        self.batch = batch
+        self.df = df
+        self.index_columns = index_columns
+
+    def run(self):
+        # SQLite connections belong to the thread that opened them
+        database = project_db.ProjectDatabase(self.project_dir)
+        try:
+            database.add_batch(self.batch, self.df, self.index_columns,
+                               progress=self.database_import_progress.emit)
+        except Exception as e:
+            self.database_import_error.emit(e)
+        else:
+            self.database_import_finished.emit()
+        finally:
+            database.close()
+
+
 class NewProjectDialog(qtw.QDialog):
     create_project_signal = qtc.pyqtSignal(str)
 
@@ -127,9 +305,7 @@ class NewProjectDialog(qtw.QDialog):
                 os.mkdir(self.project_dir_line_edit.text())
 
             config_filepath = os.path.join(self.project_dir_line_edit.text(), 'config.yml')
-            config_file = open(config_filepath, 'w')
-            yaml.dump(config, stream=config_file, Dumper=yaml.Dumper)
-            config_file.close()
+            config_store.write_atomic(config_filepath, config)
         except:
             qtw.QMessageBox.critical(
                 self,
@@ -169,11 +345,28 @@ class NewProjectDialog(qtw.QDialog):
 
 class MainProjectWindow(qtw.QMainWindow):
     close_signal = qtc.pyqtSignal()
+    # emitted from the thread writing config.yml
+    config_saved = qtc.pyqtSignal()
+    config_save_error = qtc.pyqtSignal(Exception)
     settings = qtc.QSettings('MUMT', 'Mivisor2')
 
     def __init__(self):
         super(MainProjectWindow, self).__init__()
         self.config_data = None
+        self.profile_threads = []
+        # kept across imports so unchanged custom columns are not rebuilt
+        self.derived_columns = DerivedColumns()
+        self.project_db = None
+        # (filename, sheet, rows) of each sheet of a folder import
+        self.source_parts = None
+        # the data shown were loaded from the project database, not from the source
+        self.database_data = False
+        # roles detected for roles not chosen yet, kept out of the config until saved
+        self.suggested_roles = {}
+        self.config_saved.connect(lambda: qtw.QMessageBox.information(
+            self, 'Finished', 'Project profile have been saved.', qtw.QMessageBox.Ok))
+        self.config_save_error.connect(lambda e: qtw.QMessageBox.critical(
+            self, 'Error Occurred', 'Failed to save the project profile.\n{}'.format(e)))
 
         menubar = self.menuBar()
         project_menu = menubar.addMenu('Project')
@@ -183,6 +376,22 @@ class MainProjectWindow(qtw.QMainWindow):
         group_value_menu = tool_menu.addMenu('Group values')
         self.group_text_menu = group_value_menu.addAction('Group text values', self.show_group_values_dialog)
         self.manage_groups = group_value_menu.addAction('Manage columns')
+        tool_menu.addAction('Annotate organisms', self.annotate_organisms)
+        tool_menu.addAction('Antibiogram', self.show_antibiogram)
+        tool_menu.addAction('Stratified antibiogram', self.show_stratified_antibiogram_dialog)
+        tool_menu.addAction('Resistance trends', self.show_trend_dialog)
+        cumulative_menu = tool_menu.addMenu('Cumulative antibiogram')
+        cumulative_menu.addAction('Add current data', self.add_data_to_aggregates)
+        cumulative_menu.addAction('Show', self.show_cumulative_antibiogram)
+        cumulative_menu.addAction('Check current data', self.check_aggregates)
+        database_menu = menubar.addMenu('Database')
+        self.database_actions = [
+            database_menu.addAction('Add current data', self.add_data_to_database),
+            database_menu.addAction('Load data...', lambda: self.show_database_filter_dialog(
+                'Load Data', self.load_data_from_database)),
+            database_menu.addAction('Antibiogram...', lambda: self.show_database_filter_dialog(
+                'Antibiogram', self.show_database_antibiogram)),
+        ]
         drug_registry = registry_menu.addAction('Drug', self.showDrugRegistryDialog)
         organism_registry = registry_menu.addAction('Organism', self.showOrgRegistryDialog)
 
@@ -200,7 +409,10 @@ class MainProjectWindow(qtw.QMainWindow):
 
         self.creator_label = qtw.QLabel()
         info_group.layout().addWidget(self.creator_label)
-        info_group.layout().addWidget(qtw.QLabel('Current Database: '))
+        self.database_label = qtw.QLabel('Current Database: ')
+        info_group.layout().addWidget(self.database_label)
+        self.memory_label = qtw.QLabel()
+        info_group.layout().addWidget(self.memory_label)
         info_group.setSizePolicy(qtw.QSizePolicy.Preferred,
                                  qtw.QSizePolicy.Fixed)
         self.load_config()
@@ -228,19 +440,35 @@ class MainProjectWindow(qtw.QMainWindow):
         self.data_table.setSelectionBehavior(qtw.QTableView.SelectColumns)
         self.data_table.clicked.connect(self.data_table_item_changed)
         self.data_table.horizontalHeader().sectionClicked.connect(self.data_table_column_changed)
+        self.data_table.horizontalHeader().setSortIndicatorShown(True)
+        self.data_table.horizontalHeader().setSortIndicator(-1, qtc.Qt.AscendingOrder)
+        filter_layout = qtw.QHBoxLayout()
+        filter_layout.addWidget(qtw.QLabel('Filter'))
+        self.filter_edit = qtw.QLineEdit()
+        self.filter_edit.setPlaceholderText(
+            'e.g. organism = eco; date between 2020-01-01 and 2020-12-31; ward in (icu, w1)')
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.returnPressed.connect(self.apply_table_filter)
+        self.filter_edit.textChanged.connect(self.table_filter_text_changed)
+        filter_layout.addWidget(self.filter_edit)
+        self.filter_label = qtw.QLabel()
+        filter_layout.addWidget(self.filter_label)
         vlayout.addWidget(info_group)
+        vlayout.addLayout(filter_layout)
         vlayout.addWidget(self.data_table)
         vlayout.addWidget(field_group)
         main_container.setLayout(vlayout)
         self.setCentralWidget(main_container)
         toolbar = self.addToolBar('Data')
-        db_connect_action = toolbar.addAction(
+        self.db_connect_action = toolbar.addAction(
             qtg.QIcon('../icons/database/files/48X48/data_right.png'),
             'Connect database',
+            self.connect_database
         )
-        db_disconnect_action = toolbar.addAction(
+        self.db_disconnect_action = toolbar.addAction(
             qtg.QIcon('../icons/database/files/48X48/data_delete.png'),
             'Disconnect database',
+            self.disconnect_database
         )
         data_import_action = toolbar.addAction(
             # qtg.QIcon('../icons/database/files/48X48/table_add.png'),
@@ -248,6 +476,11 @@ class MainProjectWindow(qtw.QMainWindow):
             'Import data',
             self.openImportDialog
         )
+        folder_import_action = toolbar.addAction(
+            qtg.QIcon('../icons/Koloria-Icon-Set/Folder_Add.png'),
+            'Import folder',
+            self.openImportFolderDialog
+        )
 
         save_config_action = toolbar.addAction(
             qtg.QIcon('../icons/Koloria-Icon-Set/File_List.png'),
@@ -272,14 +505,16 @@ class MainProjectWindow(qtw.QMainWindow):
             'Help',
         )
 
-        db_connect_action.setEnabled(False)
-        db_disconnect_action.setEnabled(False)
+        self.update_database_actions()
 
     def load_config(self):
+        if self.config_data is not None:
+            # finish writing the config of the previous project first
+            self.config_data.flush()
         config_filepath = os.path.join(self.settings.value('current_proj_dir', '', str), 'config.yml')
         if config_filepath and os.path.exists(config_filepath):
-            self.config_data = yaml.load(open(config_filepath, 'r'), Loader=yaml.Loader)
-            self.creator_label.setText('Creator: {}'.format(self.config_data.get('creator')))
+            self.config_data = config_store.ConfigStore.load(config_filepath)
+            self.update_project_info()
         else:
             qtw.QMessageBox(
                 self,
@@ -291,9 +526,23 @@ class MainProjectWindow(qtw.QMainWindow):
 
     def openConfigDialog(self):
         project_setting_dialog = ProjectSettingDialog(self, self.config_data)
-        project_setting_dialog.update_config_signal.connect(self.load_config)
+        project_setting_dialog.update_config_signal.connect(self.update_project_info)
+
+    def update_project_info(self):
+        self.creator_label.setText('Creator: {}'.format(self.config_data.get('creator')))
+
+    def save_config(self, announce=False):
+        if announce:
+            self.config_data.schedule_save(
+                lambda e: self.config_save_error.emit(e) if e else self.config_saved.emit())
+        else:
+            self.config_data.schedule_save(lambda e: e and self.config_save_error.emit(e))
 
     def closeEvent(self, event):
+        self.disconnect_database()
+        if self.config_data is not None:
+            self.config_data.flush()
+        importers.close_workbooks()
         self.close_signal.emit()
 
     def openImportDialog(self):
@@ -304,11 +553,15 @@ class MainProjectWindow(qtw.QMainWindow):
 
         filename, type_ = qtw.QFileDialog.getOpenFileName(
             self,
-            'Import Excel file',
+            'Import Excel or CSV file',
             projdir,
-            "Excel files (*.xls *.xlsx)"
+            "Data files (*.xls *.xlsx *.csv *.tsv *.txt);;Excel files (*.xls *.xlsx);;"
+            "CSV or TSV files (*.csv *.tsv *.txt)"
         )
-        if filename:
+        if filename and importers.is_delimited(filename):
+            # text files have no worksheets to choose from
+            self.read_excel_sheet(filename, None)
+        elif filename:
             self.xlrd_reader = XlrdOpenFileThread(filename)
             self.xlrd_reader.xlrd_read_workbook_finished.connect(
                 lambda sheets: self.showWorksheetListDlg(filename, sheets))
@@ -337,26 +590,208 @@ class MainProjectWindow(qtw.QMainWindow):
             False
         )
         if worksheet and ok:
-            self.pandas_excel_reader = PandasReadExcelThread(filename, worksheet)
-            self.pandas_excel_reader.pandas_read_excel_finished.connect(self.read_from_excel_action)
-            pandasExcelDialog = NotificationDialog(self, 'Action in Progress', 'Reading data, please wait..')
-            self.pandas_excel_reader.started.connect(pandasExcelDialog.show)
-            self.pandas_excel_reader.finished.connect(pandasExcelDialog.close)
-            self.pandas_excel_reader.start()
+            self.read_excel_sheet(filename, worksheet)
+
+    def openImportFolderDialog(self):
+        projdir = self.settings.value('current_proj_dir')
+        if not projdir:
+            projdir = qtc.QDir.homePath()
+        folder = qtw.QFileDialog.getExistingDirectory(
+            self,
+            'Import all Excel files of a folder',
+            projdir
+        )
+        if not folder:
+            return
+        filenames = importers.excel_files(folder)
+        if not filenames:
+            qtw.QMessageBox.warning(self, 'No Excel Files', 'The folder has no Excel files.')
+            return
+        # the sheets are chosen from the first workbook as in a single import
+        self.xlrd_reader = XlrdOpenFileThread(filenames[0])
+        self.xlrd_reader.xlrd_read_workbook_finished.connect(
+            lambda sheets: self.showFolderWorksheetListDlg(folder, sheets))
+        self.xlrd_reader.xlrd_read_workbook_error.connect(
+            lambda e: qtw.QMessageBox.critical(
+                self,
+                'Error Occurred',
+                str(e)
+            )
+        )
+        self.xlrdDialog = NotificationDialog(self,
+                                             'Action in Progress',
+                                             'Scanning the Excel file, please wait..')
+        self.xlrd_reader.started.connect(self.xlrdDialog.show)
+        self.xlrd_reader.finished.connect(self.xlrdDialog.close)
+        self.xlrd_reader.start()
+
+    def showFolderWorksheetListDlg(self, folder, worksheets):
+        all_sheets = 'All worksheets'
+        worksheet, ok = qtw.QInputDialog.getItem(
+            self,
+            'Select a worksheet',
+            'Worksheet to read from every file',
+            worksheets + [all_sheets],
+            0,
+            False
+        )
+        if worksheet and ok:
+            self.read_excel_folder(folder, None if worksheet == all_sheets else worksheet)
+
+    def load_source_data(self):
+        source = self.config_data.get('source') if self.config_data else None
+        if source and os.path.isdir(source.get('folder', '')):
+            self.read_excel_folder(source['folder'], source.get('sheet'))
+        elif source and os.path.exists(source.get('filename', '')):
+            self.read_excel_sheet(source['filename'], source['sheet'])
+
+    def source_batch(self):
+        """Return the name of the imported data used by the aggregate store and the database."""
+        source = self.config_data.get('source', {})
+        if 'folder' in source:
+            return 'folder|{}|{}'.format(source['folder'], source.get('sheet') or '')
+        return '{}|{}'.format(source.get('filename', ''), source.get('sheet') or '')
+
+    def source_batches(self):
+        """Return (batch, first row, end row) of each file and sheet of the imported data.
+
+        The sheets of a folder are batches of their own, named like the same
+        sheet imported alone, so adding a folder again only counts new sheets.
+        """
+        if self.source_parts is None:
+            return [(self.source_batch(), 0, len(self.dataframe.data))]
+        batches = []
+        start = 0
+        for filename, sheet, rows in self.source_parts:
+            batches.append(('{}|{}'.format(filename, sheet), start, start + rows))
+            start += rows
+        return batches
+
+    def set_source_parts(self, parts):
+        self.source_parts = parts
+
+    def read_excel_folder(self, folder, sheet=None):
+        filenames = importers.excel_files(folder)
+        if not filenames:
+            qtw.QMessageBox.warning(self, 'No Excel Files', 'The folder has no Excel files.')
+            return
+        self.config_data['source'] = {'folder': folder, 'sheet': sheet}
+        self.database_data = False
+        self.folder_reader = FolderImportThread(filenames, self.config_data.get('aliases', {}),
+                                                [sheet] if sheet else None,
+                                                self.settings.value('current_proj_dir', '', str))
+        self.folder_reader.folder_import_compacted.connect(self.show_memory_report)
+        self.folder_reader.folder_import_parts.connect(self.set_source_parts)
+        self.folder_reader.folder_import_finished.connect(self.read_from_excel_action)
+        self.folder_reader.folder_import_error.connect(
+            lambda e: qtw.QMessageBox.critical(self, 'Error Occurred', str(e)))
+        self.folder_reader.folder_import_file_errors.connect(
+            lambda errors: qtw.QMessageBox.warning(
+                self,
+                'Some Files Were Not Imported',
+                '\n'.join('{}: {}'.format(os.path.basename(filename), message)
+                          for filename, message in sorted(errors.items()))
+            )
+        )
+        progress_dialog = qtw.QProgressDialog('Reading files, please wait..', 'Cancel',
+                                              0, len(filenames), self)
+        progress_dialog.setWindowTitle('Action in Progress')
+        progress_dialog.setWindowModality(qtc.Qt.WindowModal)
+        progress_dialog.setAutoReset(False)
+        progress_dialog.canceled.connect(self.folder_reader.cancel)
+        self.folder_reader.folder_import_progress.connect(
+            lambda done, total, filename: self.update_read_folder_progress(
+                progress_dialog, done, total, filename))
+        self.folder_reader.started.connect(progress_dialog.show)
+        self.folder_reader.finished.connect(progress_dialog.close)
+        self.folder_reader.start()
+
+    def update_read_folder_progress(self, dialog, done, total, filename):
+        dialog.setMaximum(total)
+        dialog.setValue(done)
+        dialog.setLabelText('Reading files, please wait..\n{} of {} files read ({})'.format(
+            done, total, os.path.basename(filename)))
+
+    def read_excel_sheet(self, filename, worksheet):
+        self.config_data['source'] = {'filename': filename, 'sheet': worksheet}
+        self.source_parts = None
+        self.database_data = False
+        dtypes, date_columns = importers.dtypes_from_config(self.config_data)
+        self.pandas_excel_reader = PandasReadExcelThread(
+            filename, worksheet,
+            project_dir=self.settings.value('current_proj_dir', '', str),
+            dtypes=dtypes,
+            date_columns=date_columns
+        )
+        self.pandas_excel_reader.pandas_read_excel_compacted.connect(self.show_memory_report)
+        self.pandas_excel_reader.pandas_read_excel_finished.connect(self.read_from_excel_action)
+        self.pandas_excel_reader.pandas_read_excel_error.connect(
+            lambda e: qtw.QMessageBox.critical(
+                self,
+                'Error Occurred',
+                str(e)
+            )
+        )
+        pandasExcelDialog = qtw.QProgressDialog('Reading data, please wait..', 'Cancel', 0, 0, self)
+        pandasExcelDialog.setWindowTitle('Action in Progress')
+        pandasExcelDialog.setWindowModality(qtc.Qt.WindowModal)
+        pandasExcelDialog.setAutoReset(False)
+        pandasExcelDialog.canceled.connect(self.pandas_excel_reader.cancel)
+        self.pandas_excel_reader.pandas_read_excel_progress.connect(
+            lambda nrows, total: self.update_read_excel_progress(pandasExcelDialog, nrows, total))
+        self.pandas_excel_reader.started.connect(pandasExcelDialog.show)
+        self.pandas_excel_reader.finished.connect(pandasExcelDialog.close)
+        self.pandas_excel_reader.start()
+
+    def update_read_excel_progress(self, dialog, nrows, total):
+        dialog.setMaximum(total)
+        dialog.setValue(nrows)
+        dialog.setLabelText('Reading data, please wait..\n{} of {} rows read'.format(nrows, total))
+
+    def start_column_profiling(self, columns=None):
+        if columns is None:
+            # a new dataset was loaded, profiles of the old one are not needed
+            for thread in self.profile_threads:
+                thread.cancel()
+        thread = ColumnProfileThread(self.dataframe.frame(columns or ()), columns)
+        thread.column_profile_ready.connect(self.dataframe.set_profile)
+        thread.finished.connect(lambda: self.profile_threads.remove(thread))
+        self.profile_threads.append(thread)
+        thread.start()
+
+    def show_memory_report(self, report):
+        before = report['before'].sum()
+        after = report['after'].sum()
+        self.memory_label.setText('Memory usage: {} (saved {} by compacting columns)'.format(
+            compaction.format_bytes(after), compaction.format_bytes(before - after)
+        ))
+        lines = []
+        for row in report.itertuples(index=False):
+            if row.before != row.after:
+                lines.append('{}: {} -> {}, {} -> {}'.format(
+                    row.column, row.old_dtype, row.new_dtype,
+                    compaction.format_bytes(row.before), compaction.format_bytes(row.after)
+                ))
+        self.memory_label.setToolTip('\n'.join(lines))
 
     def read_from_excel_action(self, df):
-        drug_data = yaml.load(open('drugs.yaml'), Loader=yaml.Loader)
-        self.dataframe = PandasModel(df, head_row=20)
+        drugs = drug_registry.load('drugs.yaml')
+        self.derived_columns.set_specs(self.config_data.get('custom_columns', {}))
+        self.dataframe = PandasModel(df, derived=self.derived_columns)
         self.data_table.setModel(self.dataframe)
+        self.filter_edit.clear()
+        self.filter_label.clear()
+        self.data_table.horizontalHeader().setSortIndicator(-1, qtc.Qt.AscendingOrder)
+        self.start_column_profiling()
+        self.prefill_column_roles(df, drugs)
+        self.populate_column_tree()
+
+    def populate_column_tree(self):
+        self.column_treewidget.clear()
         self.column_items = []
         aliases = self.config_data.get('aliases', {})
         descs = self.config_data.get('descs', {})
         keep_columns = self.config_data.get('keep_columns', [])
-        drug_abbrs = []
-        for group, drugs in drug_data.items():
-            for drug in drugs:
-                name, abbrs = drug.split(';')
-                drug_abbrs += abbrs.split(',')
 
         if keep_columns:
             no_kept_columns = False
@@ -378,35 +813,70 @@ class MainProjectWindow(qtw.QMainWindow):
                 else:
                     citem.setCheckState(0, qtc.Qt.Unchecked)
 
-            if col in self.config_data.get('key_columns', []):
-                citem.setCheckState(1, qtc.Qt.Checked)
-            else:
-                citem.setCheckState(1, qtc.Qt.Unchecked)
-
-            if col in self.config_data.get('date_columns', []):
-                citem.setCheckState(2, qtc.Qt.Checked)
-            else:
-                citem.setCheckState(2, qtc.Qt.Unchecked)
-
-            if (len(self.config_data.get('drug_columns', [])) == 0 and col in drug_abbrs):
-                citem.setCheckState(3, qtc.Qt.Checked)
-            elif col in self.config_data.get('drug_columns', []):
-                citem.setCheckState(3, qtc.Qt.Checked)
-            else:
-                citem.setCheckState(3, qtc.Qt.Unchecked)
-
-            if col == self.config_data.get('organism_column', ''):
-                citem.setCheckState(4, qtc.Qt.Checked)
-            else:
-                citem.setCheckState(4, qtc.Qt.Unchecked)
+            for ncol, role in ROLE_COLUMNS:
+                citem.setCheckState(ncol, self.role_check_state(role, col))
 
             citem.setFlags(citem.flags() | qtc.Qt.ItemIsEditable)
             self.column_items.append(citem)
 
         self.config_data['keep_columns'] = keep_columns
 
+    def prefill_column_roles(self, df, drugs):
+        """Suggest columns for the roles not chosen yet.
+
+        Suggestions are partly ticked in the column tree. They go into the
+        config when they are ticked or when the profile is saved.
+        """
+        organism_codes = organism_registry.load('organisms.yaml').codes()
+        roles = column_roles.detect_roles(df, organism_codes, drugs)
+        self.suggested_roles = {role: columns for role, columns in roles.items()
+                                if columns and not self.config_data.get(role)}
+
+    def role_check_state(self, role, col):
+        if role == 'organism_column':
+            chosen = col == self.config_data.get(role, '')
+            suggested = col == self.suggested_roles.get(role)
+        else:
+            chosen = col in self.config_data.get(role, [])
+            suggested = col in self.suggested_roles.get(role, [])
+        if chosen:
+            return qtc.Qt.Checked
+        if suggested:
+            return qtc.Qt.PartiallyChecked
+        return qtc.Qt.Unchecked
+
+    def drop_suggested_role(self, role, colname):
+        if role == 'organism_column':
+            # only one organism column, a choice replaces the suggestion
+            if self.suggested_roles.pop(role, None) is not None:
+                for citem in self.column_items:
+                    if citem.checkState(4) == qtc.Qt.PartiallyChecked:
+                        citem.setCheckState(4, qtc.Qt.Unchecked)
+        elif colname in self.suggested_roles.get(role, []):
+            self.suggested_roles[role].remove(colname)
+
+    def apply_suggested_roles(self):
+        for role, columns in self.suggested_roles.items():
+            if role == 'organism_column':
+                if not self.config_data.get(role):
+                    self.config_data[role] = columns
+            else:
+                chosen = self.config_data.get(role, [])
+                self.config_data[role] = chosen + [col for col in columns if col not in chosen]
+        self.suggested_roles = {}
+        for citem in self.column_items:
+            for ncol, role in ROLE_COLUMNS:
+                if citem.checkState(ncol) == qtc.Qt.PartiallyChecked:
+                    citem.setCheckState(ncol, qtc.Qt.Checked)
+
     def column_treewidget_item_clicked(self, item, ncol):
         colname = item.text(0)
+        role = dict(ROLE_COLUMNS).get(ncol)
+        if role is not None:
+            if item.checkState(ncol) == qtc.Qt.PartiallyChecked:
+                # clicked beside the box of a suggestion
+                return
+            self.drop_suggested_role(role, colname)
         if ncol == 1:
             key_columns = self.config_data.get('key_columns', [])
             if item.checkState(ncol) == qtc.Qt.Checked:
@@ -430,7 +900,7 @@ class MainProjectWindow(qtw.QMainWindow):
         elif ncol == 2:
             date_columns = self.config_data.get('date_columns', [])
             if item.checkState(ncol) == qtc.Qt.Checked:
-                if not is_datetime64_any_dtype(self.data_table.model().data[colname]):
+                if not column_roles.looks_like_dates(self.data_table.model().column(colname)):
                     response = qtw.QMessageBox.warning(
                         self,
                         'Invalid Date Data',
@@ -468,21 +938,80 @@ class MainProjectWindow(qtw.QMainWindow):
                     self.config_data['organism_column'] = ''
 
     def column_treewidget_current_item_changed(self):
+        if self.column_treewidget.currentItem() is None:
+            return
         column = self.column_treewidget.currentItem().text(0)
-        self.info_textedit.setText(str(self.data_table.model().describe(column)))
+        self.info_textedit.setText(self.data_table.model().describe(column))
         self.data_table.selectColumn(self.data_table.model().columns.to_list().index(column))
 
     @qtc.pyqtSlot(int)
     def data_table_column_changed(self, colindex):
         self.column_treewidget.setCurrentItem(self.column_items[colindex])
-        print(colindex)
+        self.sort_data_table(colindex)
+
+    def sort_data_table(self, colindex):
+        """Sort by the clicked column, or add it as the next sort column with shift held.
+
+        Clicking the column sorted by again reverses its order.
+        """
+        model = self.data_table.model()
+        column = model.columns[colindex]
+        keys = list(model.sort_keys)
+        names = [name for name, _ in keys]
+        if qtw.QApplication.keyboardModifiers() & qtc.Qt.ShiftModifier:
+            if column in names:
+                pos = names.index(column)
+                keys[pos] = (column, not keys[pos][1])
+            else:
+                keys.append((column, True))
+        elif names == [column]:
+            keys = [(column, not keys[0][1])]
+        else:
+            keys = [(column, True)]
+        model.sort_by(keys)
+        primary, ascending = keys[0]
+        self.data_table.horizontalHeader().setSortIndicator(
+            model.columns.get_loc(primary), qtc.Qt.AscendingOrder if ascending else qtc.Qt.DescendingOrder)
 
     @qtc.pyqtSlot(qtc.QModelIndex)
     def data_table_item_changed(self, curindex):
         print(curindex.column())
 
-    def save_config_data(self):
-        config_filepath = os.path.join(self.settings.value('current_proj_dir'), 'config.yml')
+    def apply_table_filter(self):
+        model = self.data_table.model()
+        if model is None:
+            return
+        try:
+            model.set_filter(self.filter_edit.text())
+        except row_filters.FilterError as e:
+            qtw.QMessageBox.warning(self, 'Invalid Filter', str(e))
+            return
+        self.show_table_state()
+
+    def show_table_state(self):
+        """Show the filter and sort of the table, also after columns changed values."""
+        model = self.data_table.model()
+        if self.filter_edit.text().strip() and not model.filter_clauses:
+            qtw.QMessageBox.warning(self, 'Invalid Filter',
+                                    'The filter cannot be used on the new values and has been cleared.')
+            self.filter_edit.clear()
+        if model.filter_clauses:
+            self.filter_label.setText('{} of {} rows'.format(model.visible_row_count(), len(model.data)))
+        else:
+            self.filter_label.clear()
+        if model.sort_keys:
+            primary, ascending = model.sort_keys[0]
+            self.data_table.horizontalHeader().setSortIndicator(
+                model.columns.get_loc(primary), qtc.Qt.AscendingOrder if ascending else qtc.Qt.DescendingOrder)
+        else:
+            self.data_table.horizontalHeader().setSortIndicator(-1, qtc.Qt.AscendingOrder)
+
+    def table_filter_text_changed(self, text):
+        # clearing the filter shows every row again without pressing enter
+        if not text.strip():
+            self.apply_table_filter()
+
+    def update_aliases(self):
         aliases = {}
         descs = {}
         for citem in self.column_items:
@@ -490,24 +1019,452 @@ class MainProjectWindow(qtw.QMainWindow):
             descs[citem.text(0)] = citem.text(6)
         self.config_data['aliases'] = aliases
         self.config_data['descs'] = descs
+
+    def save_config_data(self):
+        self.apply_suggested_roles()
+        self.update_aliases()
+        self.save_config(announce=True)
+
+    def show_result_dialog(self, title, result):
+        dialog = qtw.QDialog(self)
+        dialog.setWindowTitle(title)
+        dialog.setLayout(qtw.QVBoxLayout())
+        table = qtw.QTableView()
+        table.setModel(PandasModel(result))
+        dialog.layout().addWidget(table)
+        button_box = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Close)
+        button_box.rejected.connect(dialog.close)
+        dialog.layout().addWidget(button_box)
+        dialog.resize(800, 500)
+        dialog.show()
+
+    def has_analysis_columns(self):
+        if self.data_table.model() is None:
+            qtw.QMessageBox.warning(self, 'No Data', 'Please import data first.')
+            return False
+        if not self.config_data.get('organism_column') or not self.config_data.get('drug_columns'):
+            message = 'Please choose the organism column and at least one drug column.'
+            if self.suggested_roles:
+                message += '\nSuggested columns are partly ticked, tick them or save the profile to use them.'
+            qtw.QMessageBox.warning(self, 'Missing Columns', message)
+            return False
+        return True
+
+    def analysis_data(self):
+        """Return the data with the custom columns chosen in the column roles."""
+        columns = (self.config_data.get('key_columns', []) + self.config_data.get('date_columns', [])
+                   + self.config_data.get('drug_columns', []) + [self.config_data.get('organism_column')])
+        return self.data_table.model().frame(columns)
+
+    def deduplicated_data(self):
+        df = self.analysis_data()
+        if not self.config_data.get('key_columns') or not self.config_data.get('date_columns'):
+            return df
+        options = ['Include all isolates'] + list(deduplication.WINDOWS)
+        option, ok = qtw.QInputDialog.getItem(
+            self,
+            'Duplicate Isolates',
+            'Isolates',
+            options,
+            0,
+            False
+        )
+        if not ok:
+            return None
+        if option not in deduplication.WINDOWS:
+            return df
+        return deduplication.deduplicate_from_config(df, self.config_data,
+                                                     deduplication.WINDOWS[option])
+
+    def annotate_organisms(self):
+        if self.data_table.model() is None:
+            qtw.QMessageBox.warning(self, 'No Data', 'Please import data first.')
+            return
+        organism_column = self.config_data.get('organism_column')
+        if not organism_column:
+            qtw.QMessageBox.warning(self, 'Missing Columns', 'Please choose the organism column.')
+            return
+        model = self.data_table.model()
         try:
-            yaml.dump(self.config_data,
-                      stream=open(config_filepath, 'w'),
-                      Dumper=yaml.Dumper)
+            annotations, unmatched = organism_registry.enrich(model.column(organism_column),
+                                                              organism_registry.load('organisms.yaml'))
         except Exception as e:
-            response = qtw.QMessageBox.critical(
+            qtw.QMessageBox.critical(self, 'Error Occurred', str(e))
+            return
+        model.insert_columns(organism_column, annotations)
+        self.show_table_state()
+        self.start_column_profiling(list(annotations.columns))
+        keep_columns = self.config_data.get('keep_columns', [])
+        keep_columns += [col for col in annotations.columns if col not in keep_columns]
+        self.config_data['keep_columns'] = keep_columns
+        # keep aliases and descriptions typed in the tree but not saved yet
+        self.update_aliases()
+        self.populate_column_tree()
+        if not unmatched.empty:
+            self.show_result_dialog('Organism Codes Not in the Registry',
+                                    unmatched.rename_axis('code').reset_index())
+
+    def show_antibiogram(self):
+        if not self.has_analysis_columns():
+            return
+        df = self.deduplicated_data()
+        if df is None:
+            return
+        result = antibiogram.compute_from_config(df, self.config_data)
+        self.show_result_dialog('Antibiogram', result)
+
+    def show_stratified_antibiogram_dialog(self):
+        if not self.has_analysis_columns():
+            return
+        columns = self.data_table.model().columns
+        dialog = qtw.QDialog(self)
+        dialog.setWindowTitle('Stratified Antibiogram')
+        dialog.setLayout(qtw.QVBoxLayout())
+        dialog.layout().addWidget(qtw.QLabel('Split the antibiogram by'))
+        dialog.strata_list = qtw.QListWidget()
+        for date_column in self.config_data.get('date_columns', []):
+            item = qtw.QListWidgetItem('Year of {}'.format(date_column), dialog.strata_list)
+            item.setData(qtc.Qt.UserRole, ('year', date_column))
+            item.setCheckState(qtc.Qt.Unchecked)
+        for column in self.config_data.get('keep_columns', columns):
+            if column in self.config_data.get('drug_columns', []) or column not in columns:
+                continue
+            item = qtw.QListWidgetItem(column, dialog.strata_list)
+            item.setData(qtc.Qt.UserRole, ('column', column))
+            item.setCheckState(qtc.Qt.Unchecked)
+        dialog.layout().addWidget(dialog.strata_list)
+        button_box = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Ok | qtw.QDialogButtonBox.Cancel)
+        button_box.accepted.connect(lambda: self.run_stratified_antibiogram(dialog))
+        button_box.rejected.connect(dialog.close)
+        dialog.layout().addWidget(button_box)
+        dialog.resize(400, 400)
+        dialog.show()
+
+    def run_stratified_antibiogram(self, dialog):
+        selected = []
+        for i in range(dialog.strata_list.count()):
+            item = dialog.strata_list.item(i)
+            if item.checkState() == qtc.Qt.Checked:
+                selected.append(item.data(qtc.Qt.UserRole))
+        if not selected:
+            qtw.QMessageBox.warning(dialog, 'No Columns Selected', 'Please choose at least one column.')
+            return
+        dialog.close()
+        df = self.deduplicated_data()
+        if df is None:
+            return
+        strata = []
+        for kind, column in selected:
+            if kind == 'year':
+                strata.append(pd.to_datetime(df[column], errors='coerce').dt.year.rename('Year of {}'.format(column)))
+            elif column in df.columns:
+                strata.append(column)
+            else:
+                strata.append(self.data_table.model().column(column).reindex(df.index))
+
+        self.stratified_thread = StratifiedAntibiogramThread(
+            df,
+            self.config_data['organism_column'],
+            self.config_data['drug_columns'],
+            strata
+        )
+        progress_dialog = qtw.QProgressDialog('Computing antibiograms..', 'Cancel', 0, 0, self)
+        progress_dialog.setWindowTitle('Action in Progress')
+        progress_dialog.setWindowModality(qtc.Qt.WindowModal)
+        progress_dialog.setAutoReset(False)
+        progress_dialog.canceled.connect(self.stratified_thread.cancel)
+        self.stratified_thread.stratified_antibiogram_progress.connect(
+            lambda done, total: self.update_stratified_progress(progress_dialog, done, total))
+        self.stratified_thread.stratified_antibiogram_finished.connect(
+            lambda result: self.show_result_dialog('Stratified Antibiogram', result))
+        self.stratified_thread.stratified_antibiogram_error.connect(
+            lambda e: qtw.QMessageBox.critical(self, 'Error Occurred', str(e)))
+        self.stratified_thread.started.connect(progress_dialog.show)
+        self.stratified_thread.finished.connect(progress_dialog.close)
+        self.stratified_thread.start()
+
+    def update_stratified_progress(self, dialog, done, total):
+        dialog.setMaximum(total)
+        dialog.setValue(done)
+        dialog.setLabelText('Computing antibiograms..\n{} of {} strata done'.format(done, total))
+
+    def show_trend_dialog(self):
+        if not self.has_analysis_columns():
+            return
+        if not self.config_data.get('date_columns'):
+            qtw.QMessageBox.warning(self, 'Missing Columns', 'Please choose a date column.')
+            return
+        df = self.deduplicated_data()
+        if df is None:
+            return
+        try:
+            # the rows are counted once, other periods are summed from the monthly counts
+            trend_counts = trends.TrendCounts.from_config(df, self.config_data)
+        except Exception as e:
+            qtw.QMessageBox.critical(self, 'Error Occurred', str(e))
+            return
+        dialog = qtw.QDialog(self)
+        dialog.setWindowTitle('Resistance Trends')
+        dialog.setLayout(qtw.QVBoxLayout())
+        dialog.trend_counts = trend_counts
+        if trend_counts.undated:
+            dialog.layout().addWidget(qtw.QLabel(
+                '{} isolates without a valid date in {} are not included.'.format(
+                    trend_counts.undated, self.config_data['date_columns'][0])))
+        option_layout = qtw.QFormLayout()
+        dialog.freq_combo = qtw.QComboBox()
+        dialog.freq_combo.addItems([freq.capitalize() for freq in trends.FREQUENCIES])
+        option_layout.addRow('Period', dialog.freq_combo)
+        dialog.value_combo = qtw.QComboBox()
+        dialog.value_combo.addItems(['%R', '%I', '%S', 'N'])
+        option_layout.addRow('Value', dialog.value_combo)
+        dialog.min_tested_spinbox = qtw.QSpinBox()
+        dialog.min_tested_spinbox.setRange(1, 1000)
+        option_layout.addRow('Minimum isolates', dialog.min_tested_spinbox)
+        dialog.layout().addLayout(option_layout)
+        dialog.table = qtw.QTableView()
+        dialog.layout().addWidget(dialog.table)
+        dialog.freq_combo.currentIndexChanged.connect(lambda: self.update_trend_table(dialog))
+        dialog.value_combo.currentIndexChanged.connect(lambda: self.update_trend_table(dialog))
+        dialog.min_tested_spinbox.valueChanged.connect(lambda: self.update_trend_table(dialog))
+        button_box = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Close)
+        button_box.rejected.connect(dialog.close)
+        dialog.layout().addWidget(button_box)
+        self.update_trend_table(dialog)
+        dialog.resize(900, 500)
+        dialog.show()
+
+    def update_trend_table(self, dialog):
+        freq = trends.FREQUENCIES[dialog.freq_combo.currentIndex()]
+        result = dialog.trend_counts.pivot(freq, dialog.value_combo.currentText(),
+                                           dialog.min_tested_spinbox.value())
+        dialog.table.setModel(PandasModel(result))
+
+    def add_data_to_aggregates(self):
+        if not self.has_analysis_columns() or not self.has_source_data():
+            return
+        if not self.config_data.get('date_columns'):
+            qtw.QMessageBox.warning(self, 'Missing Columns', 'Please choose a date column.')
+            return
+        batches = self.source_batches()
+        store = aggregates.AggregateStore(self.settings.value('current_proj_dir', '', str))
+        replace = False
+        added = [batch for batch, _, _ in batches if store.has_batch(batch)]
+        if len(added) == len(batches):
+            response = qtw.QMessageBox.question(
                 self,
-                'Error Occurred',
-                str(e),
-                qtw.QMessageBox.Abort
+                'Data Already Added',
+                'This data has already been added. Do you want to replace its counts?',
+                qtw.QMessageBox.Yes | qtw.QMessageBox.No, qtw.QMessageBox.No
             )
+            if response != qtw.QMessageBox.Yes:
+                return
+            replace = True
+        elif added:
+            response = qtw.QMessageBox.question(
+                self,
+                'Data Already Added',
+                '{} of {} sheets have already been added. Do you want to replace their counts? '
+                'Otherwise only the new sheets are added.'.format(len(added), len(batches)),
+                qtw.QMessageBox.Yes | qtw.QMessageBox.No | qtw.QMessageBox.Cancel, qtw.QMessageBox.No
+            )
+            if response == qtw.QMessageBox.Cancel:
+                return
+            replace = response == qtw.QMessageBox.Yes
+        df = self.analysis_data()
+        drug_columns = [col for col in self.config_data['drug_columns'] if col in df.columns]
+        try:
+            for batch, start, stop in batches:
+                # sheets already added are skipped unless replaced
+                store.add_batch(batch,
+                                df.iloc[start:stop],
+                                self.config_data['organism_column'],
+                                drug_columns,
+                                self.config_data['date_columns'][0],
+                                replace=replace)
+            store.save()
+        except Exception as e:
+            qtw.QMessageBox.critical(self, 'Error Occurred', str(e))
         else:
             qtw.QMessageBox.information(
                 self,
                 'Finished',
-                'Project profile have been saved.',
-                qtw.QMessageBox.Ok
+                'The data have been added to the cumulative counts.'
+            )
+
+    def check_aggregates(self):
+        """Compare the stored counts of the current data with a full recount."""
+        if not self.has_analysis_columns() or not self.has_source_data():
+            return
+        if not self.config_data.get('date_columns'):
+            qtw.QMessageBox.warning(self, 'Missing Columns', 'Please choose a date column.')
+            return
+        batches = [batch for batch, _, _ in self.source_batches()]
+        store = aggregates.AggregateStore(self.settings.value('current_proj_dir', '', str))
+        if not all(store.has_batch(batch) for batch in batches):
+            qtw.QMessageBox.warning(self, 'Data Not Added',
+                                    'The current data have not been added to the cumulative counts.')
+            return
+        df = self.analysis_data()
+        drug_columns = [col for col in self.config_data['drug_columns'] if col in df.columns]
+        try:
+            matched = store.matches(df, self.config_data['organism_column'], drug_columns,
+                                    self.config_data['date_columns'][0], batches=batches)
+        except Exception as e:
+            qtw.QMessageBox.critical(self, 'Error Occurred', str(e))
+            return
+        if matched:
+            qtw.QMessageBox.information(self, 'Counts Match',
+                                        'The stored counts match a full recount of the current data.')
+        else:
+            qtw.QMessageBox.warning(
+                self,
+                'Counts Differ',
+                'The stored counts differ from the current data. Add the data again to replace them.'
+            )
+
+    def update_database_actions(self):
+        connected = self.project_db is not None
+        self.db_connect_action.setEnabled(not connected)
+        self.db_disconnect_action.setEnabled(connected)
+        for action in self.database_actions:
+            action.setEnabled(connected)
+        if connected:
+            self.database_label.setText('Current Database: {} ({} records)'.format(
+                self.project_db.filepath, self.project_db.count()))
+        else:
+            self.database_label.setText('Current Database: ')
+
+    def connect_database(self):
+        try:
+            self.project_db = project_db.ProjectDatabase(self.settings.value('current_proj_dir', '', str))
+        except Exception as e:
+            qtw.QMessageBox.critical(self, 'Error Occurred', str(e))
+        self.update_database_actions()
+
+    def disconnect_database(self):
+        if self.project_db is not None:
+            self.project_db.close()
+            self.project_db = None
+            self.update_database_actions()
+
+    def add_data_to_database(self):
+        if self.data_table.model() is None:
+            qtw.QMessageBox.warning(self, 'No Data', 'Please import data first.')
+            return
+        if not self.has_source_data():
+            return
+        batch = self.source_batch()
+        if self.project_db.has_batch(batch):
+            response = qtw.QMessageBox.question(
+                self,
+                'Data Already Added',
+                'This sheet has already been added. Do you want to replace its records?',
+                qtw.QMessageBox.Yes | qtw.QMessageBox.No, qtw.QMessageBox.No
+            )
+            if response != qtw.QMessageBox.Yes:
+                return
+        index_columns = (self.config_data.get('key_columns', []) + self.config_data.get('date_columns', [])
+                         + [self.config_data.get('organism_column')])
+        self.database_thread = DatabaseImportThread(self.settings.value('current_proj_dir', '', str),
+                                                    batch, self.analysis_data(),
+                                                    [col for col in index_columns if col])
+        progress_dialog = qtw.QProgressDialog('Adding records to the database..', None, 0, 0, self)
+        progress_dialog.setWindowTitle('Action in Progress')
+        progress_dialog.setWindowModality(qtc.Qt.WindowModal)
+        progress_dialog.setAutoReset(False)
+        self.database_thread.database_import_progress.connect(
+            lambda rows, total: (progress_dialog.setMaximum(total), progress_dialog.setValue(rows)))
+        self.database_thread.database_import_error.connect(
+            lambda e: qtw.QMessageBox.critical(self, 'Error Occurred', str(e)))
+        self.database_thread.database_import_finished.connect(self.update_database_actions)
+        self.database_thread.started.connect(progress_dialog.show)
+        self.database_thread.finished.connect(progress_dialog.close)
+        self.database_thread.start()
+
+    def show_database_filter_dialog(self, title, callback):
+        dialog = qtw.QDialog(self)
+        dialog.setWindowTitle(title)
+        dialog.setLayout(qtw.QVBoxLayout())
+        date_columns = self.config_data.get('date_columns', [])
+        dialog.date_group = qtw.QGroupBox('Date range')
+        dialog.date_group.setCheckable(True)
+        dialog.date_group.setChecked(False)
+        dialog.date_group.setEnabled(bool(date_columns))
+        date_layout = qtw.QFormLayout()
+        dialog.date_group.setLayout(date_layout)
+        dialog.start_edit = qtw.QDateEdit(calendarPopup=True)
+        dialog.end_edit = qtw.QDateEdit(calendarPopup=True)
+        if date_columns:
+            first, last = self.project_db.date_range(date_columns[0])
+            if first is not None:
+                dialog.start_edit.setDate(first.date())
+                dialog.end_edit.setDate(last.date())
+        date_layout.addRow('From', dialog.start_edit)
+        date_layout.addRow('To', dialog.end_edit)
+        dialog.layout().addWidget(dialog.date_group)
+        form_layout = qtw.QFormLayout()
+        dialog.organisms_edit = qtw.QLineEdit()
+        dialog.organisms_edit.setPlaceholderText('All organisms, or codes separated by commas')
+        form_layout.addRow('Organisms', dialog.organisms_edit)
+        dialog.layout().addLayout(form_layout)
+        button_box = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Ok | qtw.QDialogButtonBox.Cancel)
+        button_box.accepted.connect(lambda: (dialog.close(), callback(self.database_filters(dialog))))
+        button_box.rejected.connect(dialog.close)
+        dialog.layout().addWidget(button_box)
+        dialog.show()
+
+    def database_filters(self, dialog):
+        filters = {}
+        if dialog.date_group.isChecked():
+            filters['date_column'] = self.config_data['date_columns'][0]
+            filters['start'] = dialog.start_edit.date().toPyDate()
+            filters['end'] = dialog.end_edit.date().toPyDate()
+        organisms = [code.strip() for code in dialog.organisms_edit.text().split(',') if code.strip()]
+        if organisms and self.config_data.get('organism_column'):
+            filters['organism_column'] = self.config_data['organism_column']
+            filters['organisms'] = organisms
+        return filters
+
+    def load_data_from_database(self, filters):
+        try:
+            df = self.project_db.load(date_columns=self.config_data.get('date_columns', []), **filters)
+        except Exception as e:
+            qtw.QMessageBox.critical(self, 'Error Occurred', str(e))
+            return
+        self.show_memory_report(compaction.compact_dataframe(df))
+        # the source in config.yml stays the last imported file, the data
+        # loaded here must not replace its batches
+        self.database_data = True
+        self.read_from_excel_action(df)
+
+    def has_source_data(self):
+        if self.database_data:
+            qtw.QMessageBox.warning(
+                self,
+                'Data From the Database',
+                'The data shown were loaded from the database. Please import the source file to add it.'
             )
+            return False
+        return True
+
+    def show_database_antibiogram(self, filters):
+        if not self.config_data.get('organism_column') or not self.config_data.get('drug_columns'):
+            qtw.QMessageBox.warning(
+                self,
+                'Missing Columns',
+                'Please choose the organism column and at least one drug column.'
+            )
+            return
+        # only the counts are read from the database
+        filters.pop('organism_column', None)
+        result = self.project_db.antibiogram(self.config_data['organism_column'],
+                                             self.config_data['drug_columns'], **filters)
+        self.show_result_dialog('Antibiogram', result)
+
+    def show_cumulative_antibiogram(self):
+        store = aggregates.AggregateStore(self.settings.value('current_proj_dir', '', str))
+        self.show_result_dialog('Cumulative Antibiogram', store.antibiogram())
 
     @qtc.pyqtSlot()
     def show_group_values_dialog(self):
@@ -524,6 +1481,7 @@ class MainProjectWindow(qtw.QMainWindow):
 
         dialog.colname = colname
         dialog.groups = {}
+        dialog.rules = []
         dialog.vlayout = qtw.QVBoxLayout()
         dialog.setLayout(dialog.vlayout)
         dialog.hlayout = qtw.QHBoxLayout()
@@ -532,9 +1490,9 @@ class MainProjectWindow(qtw.QMainWindow):
         dialog.coltree.setAlternatingRowColors(True)
 
         if colname and ok:
-            for val in self.data_table.model().data[colname].unique():
+            for val in self.data_table.model().column(colname).dropna().unique():
                 item = qtw.QTreeWidgetItem(dialog.coltree)
-                item.setText(0, val)
+                item.setText(0, str(val))
 
         dialog.grouptree = qtw.QTreeWidget()
         dialog.grouptree.setHeaderLabels(['Group', 'Column'])
@@ -579,8 +1537,11 @@ class MainProjectWindow(qtw.QMainWindow):
         add_group_btn = qtw.QPushButton('Add group', dialog.button_group)
         add_group_btn.clicked.connect(lambda: self.open_add_group_dialog(dialog))
         remove_group_btn = qtw.QPushButton('Remove group', dialog.button_group)
+        add_rule_btn = qtw.QPushButton('Add rule', dialog.button_group)
+        add_rule_btn.clicked.connect(lambda: self.open_add_group_rule_dialog(dialog))
         dialog.button_group_layout.addWidget(add_group_btn)
         dialog.button_group_layout.addWidget(remove_group_btn)
+        dialog.button_group_layout.addWidget(add_rule_btn)
         dialog.hlayout.addWidget(dialog.button_group)
         dialog.show()
 
@@ -594,6 +1555,59 @@ class MainProjectWindow(qtw.QMainWindow):
             item = qtw.QTreeWidgetItem(dialog.grouptree)
             item.setText(0, group)
 
+    def open_add_group_rule_dialog(self, dialog):
+        form = qtw.QDialog(dialog)
+        form.setWindowTitle('New Rule')
+        form.setLayout(qtw.QVBoxLayout())
+        form_layout = qtw.QFormLayout()
+        form.kind_combo = qtw.QComboBox()
+        form.kind_combo.addItems(value_grouping.RULE_KINDS)
+        form.pattern_edit = qtw.QLineEdit()
+        form.group_combo = qtw.QComboBox()
+        form.group_combo.setEditable(True)
+        form.group_combo.addItems([dialog.grouptree.topLevelItem(i).text(0)
+                                   for i in range(dialog.grouptree.topLevelItemCount())])
+        form.ignore_case_check = qtw.QCheckBox('Ignore case')
+        form_layout.addRow('Match', form.kind_combo)
+        form_layout.addRow('Pattern', form.pattern_edit)
+        form_layout.addRow('Group', form.group_combo)
+        form_layout.addRow('', form.ignore_case_check)
+        form.layout().addLayout(form_layout)
+        button_box = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Ok | qtw.QDialogButtonBox.Cancel)
+        button_box.accepted.connect(lambda: self.add_group_rule(dialog, form))
+        button_box.rejected.connect(form.close)
+        form.layout().addWidget(button_box)
+        form.setModal(True)
+        form.show()
+
+    def add_group_rule(self, dialog, form):
+        group = form.group_combo.currentText()
+        pattern = form.pattern_edit.text()
+        if not group or not pattern:
+            qtw.QMessageBox.critical(form, 'Missing Information', 'Please enter a pattern and a group.')
+            return
+        if form.kind_combo.currentText() == 'regex':
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                qtw.QMessageBox.critical(form, 'Invalid Pattern', str(e))
+                return
+        rule = value_grouping.GroupRule(form.kind_combo.currentText(), pattern, group,
+                                        form.ignore_case_check.isChecked())
+        dialog.rules.append(rule)
+        group_items = dialog.grouptree.findItems(group, qtc.Qt.MatchExactly, 0)
+        if group_items:
+            group_item = group_items[0]
+        else:
+            group_item = qtw.QTreeWidgetItem(dialog.grouptree)
+            group_item.setText(0, group)
+        rule_item = qtw.QTreeWidgetItem(group_item)
+        rule_item.setText(0, rule.describe())
+        rule_item.setText(1, 'rule')
+        rule_item.setData(0, qtc.Qt.UserRole, rule)
+        group_item.setExpanded(True)
+        form.close()
+
     def move_item_to_group(self, dialog):
         curcol_item = dialog.coltree.currentItem()
         curgroup_item = dialog.grouptree.currentItem()
@@ -620,7 +1634,11 @@ class MainProjectWindow(qtw.QMainWindow):
             )
             return
 
-        if curgroup_item.parent():
+        rule = curgroup_item.data(0, qtc.Qt.UserRole)
+        if curgroup_item.parent() and rule is not None:
+            dialog.rules.remove(rule)
+            curgroup_item.parent().removeChild(curgroup_item)
+        elif curgroup_item.parent():
             idx = curgroup_item.parent().indexOfChild(curgroup_item)
             item_without_parent = curgroup_item.parent().takeChild(idx)
             dialog.coltree.addTopLevelItem(item_without_parent)
@@ -632,30 +1650,42 @@ class MainProjectWindow(qtw.QMainWindow):
             dialog.close()
 
         def create_new_column(self, form, dialog):
-            df = self.data_table.model().data
-            colname_idx = df.columns.get_loc(dialog.colname)
-            default = form.default_edit.text()
-            if form.default_edit.text() == '':
-                data = df[dialog.colname].apply(lambda x: dialog.groups.get(x, x))
-                df.insert(colname_idx + 1, form.colname_edit.text(), data)
-            else:
-                data = df[dialog.colname].apply(lambda x: dialog.groups.get(x, default))
-                df.insert(colname_idx + 1, form.colname_edit.text(), data)
-            self.data_table.model().layoutChanged.emit()
-            item = qtw.QTreeWidgetItem()
-            item.setText(0, form.colname_edit.text())
-            item.setCheckState(0, qtc.Qt.Checked)
-            item.setCheckState(1, qtc.Qt.Unchecked)
-            item.setCheckState(2, qtc.Qt.Unchecked)
-            item.setCheckState(3, qtc.Qt.Unchecked)
-            item.setCheckState(4, qtc.Qt.Unchecked)
-            self.column_treewidget.insertTopLevelItem(colname_idx+1, item)
-            custom_columns = self.config_data.get('custom_columns', {})
-            custom_columns[form.colname_edit.text()] = {
+            model = self.data_table.model()
+            new_colname = form.colname_edit.text()
+            spec = {
                 'colname': dialog.colname,
                 'values': dialog.groups,
-                'default': default
+                'rules': [rule.to_dict() for rule in dialog.rules],
+                'default': form.default_edit.text()
             }
+            exists = new_colname in model.columns
+            try:
+                # the column is only built when it is shown or used in an analysis
+                model.add_derived_column(new_colname, spec)
+            except ValueError as e:
+                qtw.QMessageBox.warning(form, 'Invalid Column Name', str(e))
+                return
+            self.show_table_state()
+            self.start_column_profiling([new_colname])
+            if not exists:
+                colname_idx = model.columns.get_loc(new_colname)
+                item = qtw.QTreeWidgetItem()
+                item.setText(0, new_colname)
+                item.setText(5, new_colname)
+                item.setCheckState(0, qtc.Qt.Checked)
+                item.setCheckState(1, qtc.Qt.Unchecked)
+                item.setCheckState(2, qtc.Qt.Unchecked)
+                item.setCheckState(3, qtc.Qt.Unchecked)
+                item.setCheckState(4, qtc.Qt.Unchecked)
+                item.setFlags(item.flags() | qtc.Qt.ItemIsEditable)
+                self.column_treewidget.insertTopLevelItem(colname_idx, item)
+                self.column_items.insert(colname_idx, item)
+                keep_columns = self.config_data.get('keep_columns', [])
+                if new_colname not in keep_columns:
+                    keep_columns.append(new_colname)
+                self.config_data['keep_columns'] = keep_columns
+            custom_columns = self.config_data.get('custom_columns', {})
+            custom_columns[new_colname] = spec
             self.config_data['custom_columns'] = custom_columns
             response = qtw.QMessageBox.question(
                 self,
@@ -664,21 +1694,7 @@ class MainProjectWindow(qtw.QMainWindow):
                 qtw.QMessageBox.Yes | qtw.QMessageBox.No, qtw.QMessageBox.Yes
             )
             if response == qtw.QMessageBox.Yes:
-                try:
-                    config_filepath = os.path.join(self.settings.value('current_proj_dir'), 'config.yml')
-                    yaml.dump(self.config_data, stream=open(config_filepath, 'w'), Dumper=yaml.Dumper)
-                except:
-                    qtw.QMessageBox.critical(
-                        self,
-                        'Error Occurred.',
-                        'Failed to save data to file.'
-                    )
-                else:
-                    qtw.QMessageBox.information(
-                        self,
-                        'File Saved.',
-                        'File saved successfully.'
-                    )
+                self.save_config(announce=True)
             close_dialogs(form, dialog)
 
 
@@ -701,7 +1717,8 @@ class MainProjectWindow(qtw.QMainWindow):
         form.show()
 
     def showDrugRegistryDialog(self):
-        self.drug_data = yaml.load(open('drugs.yaml', 'r'), Loader=yaml.Loader)
+        # edits are made on a copy and only replace the registry when saved
+        self.drug_registry = drug_registry.load('drugs.yaml').copy()
         self.drug_dialog = qtw.QDialog(self)
         self.drug_dialog.setWindowTitle('Drug Registry')
         edit_buttons = qtw.QGroupBox('Edit')
@@ -730,18 +1747,14 @@ class MainProjectWindow(qtw.QMainWindow):
         self.drug_list = qtw.QTreeWidget()
         self.drug_list.setHeaderLabels(['Name', 'Abbreviation'])
         self.drug_list.doubleClicked.connect(self.show_edit_drug_dialog)
-        drug_items = defaultdict(list)
-        drug_group_items = {}
-        for drug_group in self.drug_data:
+        for drug_group, drugs in self.drug_registry.groups.items():
             drug_group_item = qtw.QTreeWidgetItem(self.drug_list)
             drug_group_item.setText(0, drug_group)
-            drug_group_items[drug_group] = drug_group_item
-            for drug in self.drug_data[drug_group]:
-                drug_name, abbrs = drug.split(';')
+            for drug in drugs:
                 drug_item = qtw.QTreeWidgetItem(drug_group_item)
-                drug_item.setText(0, drug_name)
-                drug_item.setText(1, abbrs)
-                drug_items[drug_group].append(drug_item)
+                drug_item.setText(0, drug.name)
+                drug_item.setText(1, ','.join(drug.abbrs))
+                drug_item.setData(0, qtc.Qt.UserRole, drug)
 
         list_layout.addWidget(self.drug_list)
         list_layout.addWidget(edit_buttons)
@@ -753,7 +1766,7 @@ class MainProjectWindow(qtw.QMainWindow):
         self.drug_dialog.show()
 
     def save_drug_registry(self):
-        yaml.dump(self.drug_data, stream=open('drugs.yaml', 'w'), Dumper=yaml.Dumper)
+        self.drug_registry.save('drugs.yaml')
         self.drug_dialog.close()
 
     def add_drug_group(self):
@@ -761,7 +1774,7 @@ class MainProjectWindow(qtw.QMainWindow):
                                                        'Add Drug Group', 'Drug group:',
                                                        qtw.QLineEdit.Normal)
         if Ok and drug_group_name != '':
-            self.drug_data[drug_group_name] = []
+            self.drug_registry.add_group(drug_group_name)
             item = qtw.QTreeWidgetItem()
             item.setText(0, drug_group_name)
             self.drug_list.addTopLevelItem(item)
@@ -786,18 +1799,18 @@ class MainProjectWindow(qtw.QMainWindow):
 
     def add_drug(self, dialog):
         drug_group_item = self.drug_list.currentItem()
-        if drug_group_item.text(0) not in self.drug_data:
+        if drug_group_item.parent():
             drug_group_item = drug_group_item.parent()
 
         name = dialog.drug_name_line_edit.text()
-        abbrs = ','.join([ab.strip() for ab in dialog.drug_abbr_line_edit.text().split(',')])
-        if name != '' and abbrs != '':
-            drug_info = u'{};{}'.format(name,abbrs)
+        abbrs = drug_registry.parse_abbrs(dialog.drug_abbr_line_edit.text())
+        if name != '' and abbrs:
+            drug = self.drug_registry.add_drug(drug_group_item.text(0), name, abbrs)
             drug_item = qtw.QTreeWidgetItem()
-            drug_item.setText(0, name)
-            drug_item.setText(1, abbrs)
+            drug_item.setText(0, drug.name)
+            drug_item.setText(1, ','.join(drug.abbrs))
+            drug_item.setData(0, qtc.Qt.UserRole, drug)
             drug_group_item.addChild(drug_item)
-            self.drug_data[drug_group_item.text(0)].append(drug_info)
 
         dialog.close()
 
@@ -811,7 +1824,7 @@ class MainProjectWindow(qtw.QMainWindow):
         button_box.accepted.connect(lambda: self.edit_drug(dialog))
         button_box.rejected.connect(dialog.close)
         dialog.drug_name_line_edit = qtw.QLineEdit(curitem.text(0))
-        if curitem.text(0) not in self.drug_data:
+        if curitem.parent():
             dialog.drug_abbr_line_edit = qtw.QLineEdit(curitem.text(1))
         else:
             dialog.drug_abbr_line_edit = qtw.QLineEdit()
@@ -826,65 +1839,57 @@ class MainProjectWindow(qtw.QMainWindow):
 
     def edit_drug(self, dialog):
         curitem = self.drug_list.currentItem()
-        if curitem.text(0) in self.drug_data:
-            drugs = self.drug_data.pop(curitem.text(0))
-            self.drug_data[dialog.drug_name_line_edit.text()] = drugs
+        if not curitem.parent():
+            try:
+                self.drug_registry.rename_group(curitem.text(0), dialog.drug_name_line_edit.text())
+            except ValueError as e:
+                qtw.QMessageBox.warning(dialog, 'Rename Drug Group', str(e))
+                return
             curitem.setText(0, dialog.drug_name_line_edit.text())
         else:
-            curitem.setText(0, dialog.drug_name_line_edit.text())
-            curitem.setText(1, dialog.drug_abbr_line_edit.text())
-            for group in self.drug_data:
-                for drug in self.drug_data[group]:
-                    if drug.startswith(dialog.drug_name_line_edit.text()):
-                        self.drug_data[group].remove(drug)
-                        self.drug_data[group].append(u'{};{}'.format(
-                            dialog.drug_name_line_edit.text(),
-                            ','.join([a.strip() for a in dialog.drug_abbr_line_edit.text().split(',')])
-                        ))
+            drug = self.drug_registry.edit_drug(
+                curitem.data(0, qtc.Qt.UserRole),
+                dialog.drug_name_line_edit.text(),
+                drug_registry.parse_abbrs(dialog.drug_abbr_line_edit.text())
+            )
+            if drug is None:
+                qtw.QMessageBox.warning(dialog, 'Edit Drug',
+                                        '{} is not in the drug registry.'.format(curitem.text(0)))
+                dialog.close()
+                return
+            curitem.setText(0, drug.name)
+            curitem.setText(1, ','.join(drug.abbrs))
         dialog.close()
 
     def remove_drug_item(self):
         item = self.drug_list.currentItem()
         root = self.drug_list.invisibleRootItem()
-        if item.text(0) in self.drug_data:
-            item_ = self.drug_data.pop(item.text(0))
+        if not item.parent():
+            self.drug_registry.remove_group(item.text(0))
             root.removeChild(item)
         else:
             item.parent().removeChild(item)
-            for group in self.drug_data:
-                for drug in self.drug_data[group]:
-                    if drug.startswith(item.text(0)):
-                        self.drug_data[group].remove(drug)
+            self.drug_registry.remove_drug(item.data(0, qtc.Qt.UserRole))
 
     def showOrgRegistryDialog(self):
-        self.org_data = yaml.load(open('organisms.yaml', 'r'), Loader=yaml.Loader)
-        if self.org_data is None:
-            self.org_data = {}
+        # edits are made on a copy and only replace the registry when saved
+        self.org_registry = organism_registry.load('organisms.yaml').copy()
         self.org_dialog = qtw.QDialog()
         self.org_dialog.setWindowTitle('Organism Registry')
         self.org_dialog.main_layout = qtw.QVBoxLayout()
         self.org_dialog.h_layout = qtw.QHBoxLayout()
         self.org_dialog.setLayout(self.org_dialog.main_layout)
-        self.org_dialog.org_tr = qtw.QTreeWidget()
-        self.org_dialog.org_tr.setAlternatingRowColors(True)
-        self.org_dialog.org_tr.setSelectionMode(qtw.QAbstractItemView.SingleSelection)
-        self.org_dialog.org_tr.setHeaderLabels(['Code', 'Group', 'Gram', 'Genus',
-                                                'Species', 'Subspecies', 'Property',
-                                                'Note'])
-        self.org_dialog.org_tr.doubleClicked.connect(self.show_edit_organism_dialog)
-
-        if self.org_data:
-            for org in self.org_data.values():
-                item = qtw.QTreeWidgetItem()
-                item.setText(0, org.get('code'))
-                item.setText(1, org.get('group'))
-                item.setText(2, org.get('gram'))
-                item.setText(3, org.get('genus'))
-                item.setText(4, org.get('species'))
-                item.setText(5, org.get('subspecies'))
-                item.setText(6, org.get('property'))
-                item.setText(7, org.get('note'))
-                self.org_dialog.org_tr.addTopLevelItem(item)
+        self.org_dialog.org_model = OrganismTableModel(self.org_registry)
+        self.org_dialog.search_edit = qtw.QLineEdit()
+        self.org_dialog.search_edit.setPlaceholderText('Search code, genus, species or group')
+        self.org_dialog.search_edit.textChanged.connect(self.org_dialog.org_model.set_filter)
+        self.org_dialog.org_table = qtw.QTableView()
+        self.org_dialog.org_table.setModel(self.org_dialog.org_model)
+        self.org_dialog.org_table.setAlternatingRowColors(True)
+        self.org_dialog.org_table.setSelectionBehavior(qtw.QAbstractItemView.SelectRows)
+        self.org_dialog.org_table.setSelectionMode(qtw.QAbstractItemView.SingleSelection)
+        self.org_dialog.org_table.verticalHeader().hide()
+        self.org_dialog.org_table.doubleClicked.connect(self.show_edit_organism_dialog)
 
         self.org_dialog.button_group = qtw.QGroupBox('Edit')
         self.org_dialog.group_box_layout = qtw.QVBoxLayout()
@@ -907,7 +1912,10 @@ class MainProjectWindow(qtw.QMainWindow):
         self.org_dialog.button_box.addButton('Cancel', qtw.QDialogButtonBox.RejectRole)
         self.org_dialog.button_box.accepted.connect(self.save_org_registry)
         self.org_dialog.button_box.rejected.connect(self.org_dialog.close)
-        self.org_dialog.h_layout.addWidget(self.org_dialog.org_tr)
+        table_layout = qtw.QVBoxLayout()
+        table_layout.addWidget(self.org_dialog.search_edit)
+        table_layout.addWidget(self.org_dialog.org_table)
+        self.org_dialog.h_layout.addLayout(table_layout)
         self.org_dialog.h_layout.addWidget(self.org_dialog.button_group)
         self.org_dialog.layout().addLayout(self.org_dialog.h_layout)
         self.org_dialog.layout().addWidget(self.org_dialog.button_box)
@@ -915,64 +1923,39 @@ class MainProjectWindow(qtw.QMainWindow):
         self.org_dialog.setModal(False)
         self.org_dialog.show()
 
-    def show_add_organism_dialog(self):
+    def current_organism_code(self):
+        index = self.org_dialog.org_table.currentIndex()
+        if not index.isValid():
+            return None
+        return self.org_dialog.org_model.code(index.row())
+
+    def show_organism_form(self, organism=None):
+        organism = organism or {}
         form = qtw.QDialog(self)
         form.setLayout(qtw.QVBoxLayout())
         form_layout = qtw.QFormLayout()
-        form.code_edit = qtw.QLineEdit()
-        form.group_edit = qtw.QLineEdit()
-        form.gram_edit = qtw.QLineEdit()
-        form.genus_edit = qtw.QLineEdit()
-        form.species_edit = qtw.QLineEdit()
-        form.subspecies_edit = qtw.QLineEdit()
-        form.property_edit = qtw.QLineEdit()
-        form.note_edit = qtw.QLineEdit()
-        form_layout.addRow('Code', form.code_edit)
-        form_layout.addRow('Group', form.group_edit)
-        form_layout.addRow('Gram', form.gram_edit)
-        form_layout.addRow('Genus', form.genus_edit)
-        form_layout.addRow('Species', form.species_edit)
-        form_layout.addRow('Subspecies', form.subspecies_edit)
-        form_layout.addRow('Property', form.property_edit)
-        form_layout.addRow('Note', form.note_edit)
+        form.edits = {}
+        for field, label in zip(organism_registry.FIELDS, OrganismTableModel.HEADERS):
+            form.edits[field] = qtw.QLineEdit(organism.get(field, ''))
+            form_layout.addRow(label, form.edits[field])
         form.layout().addLayout(form_layout)
         button_box = qtw.QDialogButtonBox()
         button_box.addButton('Add', qtw.QDialogButtonBox.AcceptRole)
         button_box.addButton('Cancel', qtw.QDialogButtonBox.RejectRole)
-        button_box.accepted.connect(lambda: self.add_organism(form))
+        button_box.accepted.connect(lambda: self.add_organism(form, organism.get('code')))
         button_box.rejected.connect(form.close)
         form.layout().addWidget(button_box)
         form.setModal(True)
         form.show()
 
-    def add_organism(self, form, exists=False):
-        if exists:
-            curitem = self.org_dialog.org_tr.currentItem()
-            self.org_data.pop(curitem.text(0))
-            idx = self.org_dialog.org_tr.indexOfTopLevelItem(curitem)
-            self.org_dialog.org_tr.takeTopLevelItem(idx)
-
-        item = qtw.QTreeWidgetItem()
-        if (form.code_edit.text() and (form.genus_edit.text() or form.group_edit.text())):
-            self.org_data[form.code_edit.text()] = {
-                'code': form.code_edit.text(),
-                'group': form.group_edit.text(),
-                'gram': form.gram_edit.text(),
-                'genus': form.genus_edit.text(),
-                'species': form.species_edit.text(),
-                'subspecies': form.subspecies_edit.text(),
-                'property': form.property_edit.text(),
-                'note': form.note_edit.text(),
-            }
-            item.setText(0, form.code_edit.text())
-            item.setText(1, form.group_edit.text())
-            item.setText(2, form.gram_edit.text())
-            item.setText(3, form.genus_edit.text())
-            item.setText(4, form.species_edit.text())
-            item.setText(5, form.subspecies_edit.text())
-            item.setText(6, form.property_edit.text())
-            item.setText(7, form.note_edit.text())
-            self.org_dialog.org_tr.addTopLevelItem(item)
+    def show_add_organism_dialog(self):
+        self.show_organism_form()
+
+    def add_organism(self, form, old_code=None):
+        record = {field: edit.text() for field, edit in form.edits.items()}
+        if record['code'] and (record['genus'] or record['group']):
+            self.org_registry.set_organism(record, old_code)
+            self.org_dialog.org_model.refresh()
             form.close()
         else:
             qtw.QMessageBox.warning(
@@ -989,60 +1972,46 @@ class MainProjectWindow(qtw.QMainWindow):
             'Excel files (*.xls *xlsx)'
         )
         if filename:
-            org_df = pd.read_excel(filename).fillna('')
-            for idx, row in org_df.iterrows():
-                item = qtw.QTreeWidgetItem()
-                if row.get('code') and (row.get('genus') or row.get('group')):
-                    item.setText(0, row.get('code'))
-                    item.setText(1, row.get('group'))
-                    item.setText(2, row.get('gram'))
-                    item.setText(3, row.get('genus'))
-                    item.setText(4, row.get('species'))
-                    item.setText(5, row.get('subspecies'))
-                    item.setText(6, row.get('property'))
-                    item.setText(7, row.get('note'))
-                    self.org_dialog.org_tr.addTopLevelItem(item)
-                    self.org_data[row.get('code')] = row.to_dict()
+            try:
+                new, conflicts = self.org_registry.prepare_import(pd.read_excel(filename))
+            except Exception as e:
+                qtw.QMessageBox.critical(self.org_dialog, 'Error Occurred', str(e))
+                return
+            if not conflicts.empty:
+                response = qtw.QMessageBox.question(
+                    self.org_dialog,
+                    'Organisms Already Registered',
+                    '{} organism codes are already registered with different values, '
+                    'for example {}.\nDo you want to replace them?'.format(
+                        len(conflicts), ', '.join(conflicts.index[:5])),
+                    qtw.QMessageBox.Yes | qtw.QMessageBox.No | qtw.QMessageBox.Cancel,
+                    qtw.QMessageBox.No
+                )
+                if response == qtw.QMessageBox.Cancel:
+                    return
+                if response == qtw.QMessageBox.Yes:
+                    new = pd.concat([new, conflicts])
+            self.org_registry.add_organisms(new)
+            self.org_dialog.org_model.refresh()
 
     def remove_org(self):
-        curitem = self.org_dialog.org_tr.currentItem()
-        index = self.org_dialog.org_tr.indexOfTopLevelItem(curitem)
-        self.org_dialog.org_tr.takeTopLevelItem(index)
+        code = self.current_organism_code()
+        if code is not None:
+            self.org_registry.remove(code)
+            self.org_dialog.org_model.refresh()
 
     def show_edit_organism_dialog(self):
-        curitem = self.org_dialog.org_tr.currentItem()
-        form = qtw.QDialog(self)
-        form.setLayout(qtw.QVBoxLayout())
-        form_layout = qtw.QFormLayout()
-        form.code_edit = qtw.QLineEdit(curitem.text(0))
-        form.group_edit = qtw.QLineEdit(curitem.text(1))
-        form.gram_edit = qtw.QLineEdit(curitem.text(2))
-        form.genus_edit = qtw.QLineEdit(curitem.text(3))
-        form.species_edit = qtw.QLineEdit(curitem.text(4))
-        form.subspecies_edit = qtw.QLineEdit(curitem.text(5))
-        form.property_edit = qtw.QLineEdit(curitem.text(6))
-        form.note_edit = qtw.QLineEdit(curitem.text(7))
-        form_layout.addRow('Code', form.code_edit)
-        form_layout.addRow('Group', form.group_edit)
-        form_layout.addRow('Gram', form.gram_edit)
-        form_layout.addRow('Genus', form.genus_edit)
-        form_layout.addRow('Species', form.species_edit)
-        form_layout.addRow('Subspecies', form.subspecies_edit)
-        form_layout.addRow('Property', form.property_edit)
-        form_layout.addRow('Note', form.note_edit)
-        form.layout().addLayout(form_layout)
-        button_box = qtw.QDialogButtonBox()
-        button_box.addButton('Add', qtw.QDialogButtonBox.AcceptRole)
-        button_box.addButton('Cancel', qtw.QDialogButtonBox.RejectRole)
-        button_box.accepted.connect(lambda: self.add_organism(form, exists=True))
-        button_box.rejected.connect(form.close)
-        form.layout().addWidget(button_box)
-        form.setModal(True)
-        form.show()
+        code = self.current_organism_code()
+        if code is not None:
+            self.show_organism_form(self.org_registry.get(code))
 
     def save_org_registry(self):
-        yaml.dump(self.org_data, stream=open('organisms.yaml', 'w'), Dumper=yaml.Dumper)
-        self.org_dialog.close()
+        try:
+            self.org_registry.save('organisms.yaml')
+        except Exception as e:
+            qtw.QMessageBox.critical(self.org_dialog, 'Error Occurred', str(e))
+        else:
+            self.org_dialog.close()
 
 
 class ProjectSettingDialog(qtw.QDialog):
@@ -1070,13 +2039,10 @@ class ProjectSettingDialog(qtw.QDialog):
         self.show()
 
     def accept(self):
-        config_filepath = os.path.join(self.settings.value('current_proj_dir'), 'config.yml')
         if self.creator_edit.text():
             self.config_data['creator'] = self.creator_edit.text()
         self.config_data['desc'] = self.desc_edit.toPlainText()
-        yaml.dump(self.config_data,
-                  stream=open(config_filepath, 'w'),
-                  Dumper=yaml.Dumper)
+        self.parent().save_config()
         self.update_config_signal.emit(True)
         super(ProjectSettingDialog, self).accept()
 
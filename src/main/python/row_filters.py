@@ -0,0 +1,189 @@
+import csv
+import re
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+
+CLAUSE_SEPARATOR = ';'
+CLAUSE_RE = re.compile(
+    r'^\s*(?:"(?P<quoted>[^"]+)"|(?P<name>.+?))\s*'
+    r'(?P<op>!=|>=|<=|=|>|<|(?<=\s)(?:not\s+in|in|between|contains|is\s+not\s+empty|is\s+empty)(?=\s|\(|$))'
+    r'\s*(?P<value>.*?)\s*$',
+    re.IGNORECASE
+)
+BETWEEN_RE = re.compile(r'\s+and\s+', re.IGNORECASE)
+
+Clause = namedtuple('Clause', ['column', 'op', 'values'])
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _unquote(text):
+    text = text.strip()
+    if len(text) > 1 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    return text
+
+
+def parse_clause(text):
+    """Parse one clause such as 'ward in (icu, w1)' into a Clause.
+
+    Column names with spaces followed by an operator word have to be quoted.
+    """
+    match = CLAUSE_RE.match(text)
+    if match is None:
+        raise FilterError('Cannot understand the filter "{}".'.format(text.strip()))
+    column = match.group('quoted') or match.group('name').strip()
+    op = ' '.join(match.group('op').lower().split())
+    value = match.group('value')
+    if op in ('is empty', 'is not empty'):
+        if value:
+            raise FilterError('"{}" takes no value.'.format(op))
+        return Clause(column, op, ())
+    if op in ('in', 'not in'):
+        if value.startswith('(') and value.endswith(')'):
+            value = value[1:-1]
+        values = [_unquote(item) for item in next(csv.reader([value], skipinitialspace=True), [])]
+        values = tuple(item for item in values if item)
+    elif op == 'between':
+        values = tuple(_unquote(item) for item in BETWEEN_RE.split(value))
+        if len(values) != 2:
+            raise FilterError('Use "{} between A and B".'.format(column))
+    else:
+        values = (_unquote(value),)
+    if not values or not all(values):
+        raise FilterError('The filter "{}" has no value.'.format(text.strip()))
+    return Clause(column, op, values)
+
+
+def parse(text):
+    """Parse clauses separated by semicolons, all of which have to match."""
+    return [parse_clause(part) for part in text.split(CLAUSE_SEPARATOR) if part.strip()]
+
+
+def _convert(dtype, clause):
+    try:
+        if is_datetime64_any_dtype(dtype):
+            return [pd.Timestamp(value) for value in clause.values]
+        if is_numeric_dtype(dtype) and not is_bool_dtype(dtype):
+            return [float(value) for value in clause.values]
+    except ValueError:
+        raise FilterError('"{}" has a value of the wrong type for column {}.'.format(
+            ' '.join(clause.values), clause.column))
+    return list(clause.values)
+
+
+def _matches(values, clause):
+    """Evaluate clause on values, a Series without missing values."""
+    try:
+        return _compare(values, clause)
+    except TypeError:
+        # e.g. '>' on a column mixing text and numbers
+        raise FilterError('"{}" cannot be used on the values of column {}.'.format(
+            clause.op, clause.column))
+
+
+def _compare(values, clause):
+    op = clause.op
+    if op == 'contains':
+        return values.astype(str).str.contains(clause.values[0], case=False, regex=False)
+    if op == 'is empty':
+        return values.astype(str).str.strip() == ''
+    if op == 'is not empty':
+        return values.astype(str).str.strip() != ''
+    operands = _convert(values.dtype, clause)
+    dates = is_datetime64_any_dtype(values.dtype)
+    if op in ('in', 'not in'):
+        if dates:
+            found = values.dt.normalize().isin([day.normalize() for day in operands])
+        else:
+            found = values.isin(operands)
+        return found if op == 'in' else ~found
+    if op == 'between':
+        start, end = operands
+        if dates:
+            # the end date is included as a whole day
+            return (values >= start) & (values < end.normalize() + pd.Timedelta(days=1))
+        return (values >= start) & (values <= end)
+    operand = operands[0]
+    if dates and op in ('=', '!='):
+        same_day = values.dt.normalize() == operand.normalize()
+        return same_day if op == '=' else ~same_day
+    if op == '=':
+        return values == operand
+    if op == '!=':
+        return values != operand
+    if op == '>':
+        return values > operand
+    if op == '>=':
+        return values >= operand
+    if op == '<':
+        return values < operand
+    return values <= operand
+
+
+def evaluate(series, clause):
+    """Return a boolean array of the rows of series matching clause.
+
+    Categorical columns are matched on their categories and the result is
+    spread to the rows through the codes. Missing values only match 'is empty'.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = pd.Series(series.cat.categories)
+        matched = np.asarray(_matches(categories, clause), dtype=bool)
+        codes = series.cat.codes.to_numpy()
+        missing = codes < 0
+        mask = matched[np.maximum(codes, 0)] if len(matched) else np.zeros(len(codes), dtype=bool)
+    else:
+        missing = series.isna().to_numpy()
+        mask = np.zeros(len(series), dtype=bool)
+        present = series[~missing]
+        if len(present):
+            mask[~missing] = np.asarray(_matches(present, clause), dtype=bool)
+    if clause.op == 'is empty':
+        return mask | missing
+    return mask & ~missing
+
+
+class RowFilter(object):
+    """Turns clauses into the positions of matching rows.
+
+    column(name) returns the Series of a column. The mask of each clause is
+    kept, so changing one clause of a filter only evaluates that clause again.
+    """
+    MAX_CACHED_MASKS = 32
+
+    def __init__(self, column, columns):
+        self.column = column
+        self.columns = columns
+        self._masks = OrderedDict()
+
+    def clear(self):
+        self._masks.clear()
+
+    def mask(self, clause):
+        if clause in self._masks:
+            self._masks.move_to_end(clause)
+            return self._masks[clause]
+        if clause.column not in self.columns():
+            raise FilterError('There is no column {}.'.format(clause.column))
+        mask = evaluate(self.column(clause.column), clause)
+        self._masks[clause] = mask
+        if len(self._masks) > self.MAX_CACHED_MASKS:
+            self._masks.popitem(last=False)
+        return mask
+
+    def rows(self, clauses):
+        """Return the positions of the rows matching all clauses, None without clauses."""
+        if not clauses:
+            return None
+        masks = [self.mask(clause) for clause in clauses]
+        combined = masks[0].copy()
+        for mask in masks[1:]:
+            combined &= mask
+        return np.flatnonzero(combined)
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+
+def sort_key(series, ascending=True):
+    """Return an array that sorts like series, missing values last.
+
+    Numbers and dates are sorted as they are, other columns by integer ranks.
+    """
+    if is_datetime64_any_dtype(series.dtype):
+        missing = series.isna().to_numpy()
+        if series.dt.tz is not None:
+            # time zone aware columns come back as Timestamp objects, UTC sorts the same
+            series = series.dt.tz_convert(None)
+        values = series.to_numpy().view(np.int64)
+        return np.where(missing, np.iinfo(np.int64).max, values if ascending else -values)
+    if is_numeric_dtype(series.dtype) and not is_bool_dtype(series.dtype):
+        # NaN sorts last in both directions
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        return values if ascending else -values
+    codes, uniques = pd.factorize(series, sort=True)
+    missing = codes < 0
+    if not ascending:
+        codes = len(uniques) - 1 - codes
+    codes[missing] = len(uniques)
+    return codes
+
+
+class RowSorter(object):
+    """Turns sort keys into a permutation of the rows, without reordering the data.
+
+    column(name) returns the Series of a column. The rank and the stable
+    argsort of every column and direction are kept, so sorting again by a
+    column sorted before only looks them up.
+    """
+    MAX_CACHED_COLUMNS = 16
+
+    def __init__(self, column):
+        self.column = column
+        self._keys = OrderedDict()
+        self._orders = OrderedDict()
+
+    def clear(self):
+        self._keys.clear()
+        self._orders.clear()
+
+    def _cached(self, cache, key, build):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = build()
+        cache[key] = value
+        if len(cache) > self.MAX_CACHED_COLUMNS:
+            cache.popitem(last=False)
+        return value
+
+    def key(self, name, ascending=True):
+        return self._cached(self._keys, (name, ascending),
+                            lambda: sort_key(self.column(name), ascending))
+
+    def order(self, keys):
+        """Return the row positions sorted by keys, a list of (column, ascending).
+
+        The first key sorts first; rows with equal keys keep their order.
+        Returns None without keys.
+        """
+        keys = [(name, bool(ascending)) for name, ascending in keys]
+        if not keys:
+            return None
+        if len(keys) == 1:
+            return self._cached(self._orders, keys[0],
+                                lambda: np.argsort(self.key(*keys[0]), kind='stable'))
+        # lexsort sorts by the last array first
+        return np.lexsort([self.key(name, ascending) for name, ascending in reversed(keys)])
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+import antibiogram
+
+
+FREQUENCIES = ['month', 'quarter', 'year']
+PERIOD_FREQS = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+TREND_COLUMNS = ['period'] + antibiogram.RESULT_COLUMNS
+
+
+def month_codes(dates):
+    """Return a code per date for the months that occur, the months and the missing dates.
+
+    Dates that cannot be read count as missing. Only months with dates get
+    a code, so a mistyped year does not add every month in between.
+    """
+    dates = pd.to_datetime(dates, errors='coerce')
+    missing = dates.isna().to_numpy()
+    codes = np.full(len(missing), -1, dtype=np.int64)
+    codes[~missing], months = pd.factorize(dates.to_numpy()[~missing].astype('datetime64[M]'), sort=True)
+    return codes, pd.DatetimeIndex(months).to_period('M'), missing
+
+
+class TrendCounts(object):
+    """S/I/R counts per month, organism and drug of a dataset.
+
+    The rows are read once into an (months, organisms, drugs, 3) array of
+    the months with isolates. Quarter and year counts are summed from the
+    monthly counts and kept, so switching between periods never reads the
+    rows again. undated is the number of rows without a readable date.
+    """
+    def __init__(self, monthly, months, organisms, drugs, undated=0):
+        self.organisms = list(organisms)
+        self.drugs = list(drugs)
+        self.undated = undated
+        self._counts = {'month': (monthly, months)}
+
+    @classmethod
+    def from_data(cls, df, organism_column, drug_columns, date_column):
+        drug_columns = list(drug_columns)
+        codes, months, missing = month_codes(df[date_column])
+        nmonths = len(months)
+        organism_codes, organisms = antibiogram.encode_organisms(df[organism_column])
+        norganisms = len(organisms)
+        group_codes = np.where(~missing & (organism_codes >= 0),
+                               codes * norganisms + organism_codes,
+                               -1)
+        monthly = np.zeros((nmonths, norganisms, len(drug_columns), 3), dtype=np.int64)
+        for i, drug in enumerate(drug_columns):
+            counts = antibiogram.count_results(group_codes, nmonths * norganisms,
+                                               antibiogram.encode_results(df[drug]))
+            monthly[:, :, i, :] = counts.reshape(nmonths, norganisms, 3)
+        return cls(monthly, months, organisms, drug_columns, int(missing.sum()))
+
+    @classmethod
+    def from_config(cls, df, config_data):
+        drug_columns = [col for col in config_data.get('drug_columns', []) if col in df.columns]
+        return cls.from_data(df, config_data['organism_column'], drug_columns,
+                             config_data['date_columns'][0])
+
+    def counts(self, freq='month'):
+        """Return the counts of every period of freq and the periods."""
+        if freq not in self._counts:
+            monthly, months = self._counts['month']
+            periods = months.asfreq(PERIOD_FREQS[freq])
+            if len(periods):
+                # months are sorted, so each period is a run of months
+                starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+                self._counts[freq] = (np.add.reduceat(monthly, starts, axis=0), periods[starts])
+            else:
+                self._counts[freq] = (monthly, periods)
+        return self._counts[freq]
+
+    def table(self, freq='month'):
+        """Return the antibiogram of every period with tested isolates as a long table."""
+        counts, periods = self.counts(freq)
+        nperiods, norganisms, ndrugs = counts.shape[:3]
+        if not counts.any():
+            return pd.DataFrame(columns=TREND_COLUMNS)
+        tested = counts.reshape(-1, 3).sum(axis=1) > 0
+        period_labels = np.repeat(np.asarray(periods.astype(str), dtype=object), norganisms * ndrugs)
+        result = antibiogram.summarize(counts.reshape(nperiods * norganisms, ndrugs, 3),
+                                       np.tile(np.asarray(self.organisms, dtype=object), nperiods),
+                                       self.drugs)
+        result.insert(0, 'period', period_labels[tested])
+        return result[TREND_COLUMNS]
+
+    def pivot(self, freq='month', value='%R', min_tested=1):
+        """Return value per organism and drug with one column per period.
+
+        Periods with fewer than min_tested isolates are left empty.
+        """
+        table = self.table(freq)
+        table = table[table['N'] >= min_tested]
+        if table.empty:
+            return pd.DataFrame(columns=['organism', 'drug'])
+        # pivot only takes a list of index columns from pandas 1.1
+        result = table.set_index(['organism', 'drug', 'period'])[value].unstack('period')
+        return result.rename_axis(columns=None).reset_index()
@@ -0,0 +1,107 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+RULE_KINDS = ['exact', 'prefix', 'regex']
+
+
+class GroupRule(object):
+    def __init__(self, kind, pattern, group, ignore_case=False):
+        if kind not in RULE_KINDS:
+            raise ValueError('Unknown rule kind: {}'.format(kind))
+        self.kind = kind
+        self.pattern = pattern
+        self.group = group
+        self.ignore_case = ignore_case
+
+    def __repr__(self):
+        return 'GroupRule({!r}, {!r}, {!r}, ignore_case={!r})'.format(
+            self.kind, self.pattern, self.group, self.ignore_case)
+
+    def describe(self):
+        return '{} {}{}'.format(self.kind, self.pattern,
+                                ' (ignore case)' if self.ignore_case else '')
+
+    def to_dict(self):
+        return {'kind': self.kind, 'pattern': self.pattern,
+                'group': self.group, 'ignore_case': self.ignore_case}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['kind'], data['pattern'], data['group'], data.get('ignore_case', False))
+
+    def matches(self, values):
+        """Return a boolean array for a Series of distinct text values."""
+        if self.ignore_case:
+            values = values.str.lower()
+            pattern = self.pattern.lower()
+        else:
+            pattern = self.pattern
+        if self.kind == 'exact':
+            return (values == pattern).to_numpy()
+        elif self.kind == 'prefix':
+            return values.str.startswith(pattern).to_numpy()
+        else:
+            flags = re.IGNORECASE if self.ignore_case else 0
+            return values.str.contains(self.pattern, flags=flags, regex=True).to_numpy()
+
+
+def rules_from_groups(groups):
+    """Turn a {value: group} mapping as made by dragging values into exact rules."""
+    return [GroupRule('exact', value, group) for value, group in groups.items()]
+
+
+def _codes_and_uniques(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), pd.Index(series.cat.categories)
+    return pd.factorize(series)
+
+
+def map_uniques(uniques, rules, default=None):
+    """Map every distinct value to its group, the first matching rule wins."""
+    values = pd.Series(np.asarray(uniques, dtype=object)).astype(str)
+    mapped = np.asarray(uniques, dtype=object).copy()
+    if default is not None:
+        mapped[:] = default
+    unmatched = np.ones(len(values), dtype=bool)
+    for rule in rules:
+        if not unmatched.any():
+            break
+        hit = unmatched & rule.matches(values).astype(bool)
+        mapped[hit] = rule.group
+        unmatched &= ~hit
+    return mapped
+
+
+def apply_rules(series, rules, default=None):
+    """Group the values of series by rules and return a categorical column.
+
+    The rules only run over the distinct values (or categories) of the column;
+    the groups are then spread back to the rows with one take over the codes.
+    Values matching no rule keep their value unless a default is given;
+    missing values stay missing without a default and get the default otherwise.
+    """
+    codes, uniques = _codes_and_uniques(series)
+    mapped = map_uniques(uniques, rules, default)
+    group_codes, groups = pd.factorize(pd.Series(mapped, dtype=object))
+    missing_code = -1
+    if default is not None:
+        found = np.flatnonzero(np.asarray(groups, dtype=object) == default)
+        if len(found):
+            missing_code = found[0]
+        else:
+            missing_code = len(groups)
+            groups = groups.append(pd.Index([default], dtype=object))
+    # the code -1 of missing values takes the last entry
+    row_codes = np.append(group_codes, missing_code)[codes]
+    categorical = pd.Categorical.from_codes(row_codes, categories=pd.Index(groups, dtype=object))
+    return pd.Series(categorical, index=series.index, name=series.name)
+
+
+def apply_custom_column(df, spec):
+    """Build a grouped column from its custom_columns entry in config.yml."""
+    rules = rules_from_groups(spec.get('values', {}))
+    rules += [GroupRule.from_dict(rule) for rule in spec.get('rules', [])]
+    return apply_rules(df[spec['colname']], rules, spec.get('default') or None)